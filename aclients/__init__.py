@@ -11,5 +11,6 @@ from .aio_mongo_client import *
 from .aio_mysql_client import *
 from .aio_redis_client import *
 from .aio_http_client import *
+from .jsonrpc import *
 
 __version__ = "1.0.3"
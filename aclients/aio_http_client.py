@@ -8,37 +8,236 @@
 """
 import asyncio
 import atexit
-from typing import Dict
+import gzip
+import io
+import os
+import re
+import zlib
+from collections.abc import MutableMapping
+from functools import partial
+from json import dumps as json_dumps, loads as json_loads
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, IO, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
 import aelog
 import aiohttp
+from multidict import CIMultiDict
 
 from .err_msg import http_msg
-from .exceptions import ClientConnectionError, ClientError, ClientResponseError, HttpError
-from .utils import Singleton, verify_message
+from .exceptions import (CircuitOpenError, ClientConnectionError, ClientError, ClientResponseError, ConfigError,
+                         HttpError)
+from .http_cache import HttpCache
+from .http_metrics import HttpMetrics
+from .http_policy import CircuitBreaker, HedgePolicy, HttpTimeout, RateLimiter, RetryPolicy
+from .utils import Singleton, verify_message, wrap_async_func
+
+try:
+    import cchardet as chardet
+except ImportError:
+    chardet = None
 
 __all__ = ("AIOHttpClient", "AsyncResponse")
 
+_UNSET = object()
+TimeoutType = Union[HttpTimeout, Dict, float, None]
+# 请求体, 文件对象、文件路径(os.PathLike)、异步生成器和FormData流式发送
+DataType = Union[Dict, str, bytes, IO, os.PathLike, AsyncIterable[bytes], aiohttp.FormData, None]
+_TEXT_TYPES = ("application/javascript", "application/xml", "application/x-www-form-urlencoded")
+# 分段下载时保存下载进度的间隔, 单位秒
+DOWNLOAD_STATE_INTERVAL: float = 1
+
+
+def _is_json_type(mimetype: str) -> bool:
+    """
+    是否是json类型的mimetype
+    Args:
+
+    Returns:
+
+    """
+    return mimetype == "application/json" or mimetype.endswith("+json")
+
+
+def _is_text_type(mimetype: str) -> bool:
+    """
+    是否是文本类型的mimetype
+    Args:
+
+    Returns:
+
+    """
+    return (mimetype.startswith("text/") or mimetype in _TEXT_TYPES or mimetype.endswith("+xml") or
+            _is_json_type(mimetype))
+
+
+def _is_stream_body(data: Any) -> bool:
+    """
+    是否是流式的请求体, 流式的请求体只能发送一次
+    Args:
+
+    Returns:
+
+    """
+    return isinstance(data, (io.IOBase, aiohttp.FormData)) or hasattr(data, "__aiter__")
+
+
+def _write_at(f, offset: int, data: bytes):
+    """
+    在文件的offset处写入数据
+    Args:
+
+    Returns:
+
+    """
+    f.seek(offset)
+    f.write(data)
+
+
+def _preallocate_file(path: str, length: int):
+    """
+    预分配文件的大小
+    Args:
+
+    Returns:
+
+    """
+    with open(path, "wb") as f:
+        f.truncate(length)
+
+
+def _load_download_state(state_path: str) -> Optional[Dict]:
+    """
+    读取下载的进度, 没有或者损坏时返回None
+    Args:
+
+    Returns:
+
+    """
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_download_state(state_path: str, state: Dict):
+    """
+    保存下载的进度, 先写入临时文件再替换, 进程在写入时退出也不会损坏已有的进度
+    Args:
+
+    Returns:
+
+    """
+    tmp_path = "{}.tmp".format(state_path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json_dumps(state))
+    os.replace(tmp_path, state_path)
+
+
+def _remove_file(path: str):
+    """
+    删除文件, 文件不存在时忽略
+    Args:
+
+    Returns:
+
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 
 class AsyncResponse(object):
     """
     异步响应对象,需要重新封装对象
+
+    响应体只读取一次保存在content中,resp_body根据Content-Type在第一次访问时解码,
+    json类型解析为对象,文本类型解码为字符串,其他类型为空字符串
     """
-    __slots__ = ["status_code", "reason", "headers", "cookies", "resp_body", "content"]
+    __slots__ = ["status_code", "reason", "headers", "cookies", "content", "content_type", "charset", "_resp_body",
+                 "_json_decoder"]
 
-    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *, resp_body: Dict,
-                 content: bytes):
+    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *, resp_body: Any = _UNSET,
+                 content: bytes, content_type: str = "", charset: str = None, json_decoder: Callable = None):
         """
 
         Args:
-
+            resp_body: 已经解码的响应体,不提供时第一次访问resp_body时解码
+            content: 原始的响应体
+            content_type: 响应体的mimetype
+            charset: 响应体的编码
+            json_decoder: 解析json的函数, 需要同时支持str和bytes, 默认为标准库的json.loads
         """
         self.status_code = status_code
         self.reason = reason
         self.headers = headers
         self.cookies = cookies
-        self.resp_body = resp_body
         self.content = content
+        self.content_type = content_type
+        self.charset = charset
+        self._resp_body = resp_body
+        self._json_decoder = json_decoder or json_loads
+
+    @property
+    def resp_body(self, ) -> Any:
+        """
+        根据Content-Type解码后的响应体,只解码一次
+        Args:
+
+        Returns:
+
+        """
+        if self._resp_body is _UNSET:
+            self._resp_body = self._decode_body()
+        return self._resp_body
+
+    @property
+    def text(self, ) -> str:
+        """
+        文本形式的响应体
+        Args:
+
+        Returns:
+
+        """
+        return self._decode_text()
+
+    def _decode_text(self, ) -> str:
+        """
+        按照charset解码响应体,没有charset的时候检测编码
+        Args:
+
+        Returns:
+
+        """
+        encoding = self.charset
+        if not encoding and chardet is not None:
+            encoding = chardet.detect(self.content)["encoding"]
+        return self.content.decode(encoding or "utf-8")
+
+    def _decode_body(self, ) -> Any:
+        """
+        根据Content-Type只做一次解码
+        Args:
+
+        Returns:
+
+        """
+        if not self.content:
+            return ""
+        try:
+            if _is_json_type(self.content_type):
+                try:
+                    # 没有charset时json.loads可以直接识别utf-8/16/32编码的bytes
+                    return self._json_decoder(self.content.decode(self.charset) if self.charset else self.content)
+                except ValueError:
+                    pass
+            if _is_text_type(self.content_type):
+                return self._decode_text()
+        except (LookupError, ValueError):  # 未知编码或者解码失败
+            pass
+        return ""
 
     def json(self, ):
         """
@@ -56,17 +255,44 @@ class AIOHttpClient(Singleton):
     基于aiohttp的异步封装
     """
 
-    def __init__(self, app=None, *, timeout: int = 5 * 60, verify_ssl: bool = True, message: Dict = None,
-                 use_zh: bool = True, cookiejar_unsafe: bool = False):
+    def __init__(self, app=None, *, timeout: TimeoutType = 5 * 60, verify_ssl: bool = True, message: Dict = None,
+                 use_zh: bool = True, cookiejar_unsafe: bool = False, **kwargs):
         """
         基于aiohttp的异步封装
         Args:
             app: app应用
-            timeout:request timeout
+            timeout:request timeout, 整数为整个请求的超时, 也可以是分阶段的超时HttpTimeout
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
             cookiejar_unsafe: 是否打开cookiejar的非严格模式，默认false
+            kwargs: 其他配置
+                chunk_size: 流式读取响应体时每块的大小,默认64KB
+                limit: 连接池总的连接数限制,默认100
+                limit_per_host: 每个host(host, port, ssl)的连接数限制,默认0不限制
+                keepalive_timeout: 空闲的keep-alive连接保持的时间,单位秒,默认15
+                dns_cache_ttl: DNS解析结果缓存的时间,单位秒,默认10
+                async_resolver: 是否使用基于aiodns的异步DNS解析器,默认False使用线程池解析
+                retry_policy: 重试策略RetryPolicy,默认None不重试
+                circuit_breaker: 每个host的熔断器配置, True使用默认配置, 字典为CircuitBreaker的参数, 默认None不熔断
+                response_cache: GET响应缓存, True使用默认配置, 字典为HttpCache的参数, 默认None不缓存
+                single_flight: 是否合并同时发出的相同GET/HEAD请求, 以第一个请求的参数发送, 默认False
+                hedge_policy: 对冲请求策略HedgePolicy, 默认None不对冲
+                trace_metrics: 是否按host统计请求各个阶段的耗时, 默认True
+                rate_limits: 客户端限流配置, {host或者url的正则: RateLimiter的参数}, 如{"api.com": {"rate": 10}}
+                host_timeouts: 每个host的超时配置, {host: HttpTimeout或者整数}, 优先级高于timeout, 低于每次请求的timeout
+                compress_request: 请求体的压缩方式gzip或者deflate, 默认None不压缩
+                compress_threshold: 请求体超过这个字节数时才压缩, 默认1MB
+                compress_offload_threshold: 请求体超过这个字节数时在线程池中压缩, 默认4MB
+                accept_compressed: 是否接受压缩的响应, 默认True
+                json_decoder: 解析json响应体的函数, 如ujson.loads、orjson.loads, 默认为标准库的json.loads
+                decode_offload_threshold: json和文本响应体超过这个字节数时在线程池中解码, 默认1MB
+                profiles: 命名的客户端配置, {名称: 配置}, 配置同__init__的参数, 每个名称有独立的session和连接池,
+                          通过AIOHttpClient.get(名称)获取, 没有配置的timeout、verify_ssl、cookiejar_unsafe和消息
+                          使用当前客户端的配置, 其他参数使用默认值
+                warmup_targets: 启动时预热连接的目标, url或者{"url": url, "connections": 连接数}的列表, 默认不预热
+                warmup_connections: 每个预热目标建立的连接数, 默认2
+                warmup_timeout: 预热的超时, 单位秒, 默认5
         """
         self.app = app
         self.session = None
@@ -78,13 +304,43 @@ class AIOHttpClient(Singleton):
         # 默认clientsession使用严格版本的cookiejar, 禁止ip地址的访问共享cookie
         # 如果访问的是ip地址的URL，并且需要保持cookie则需要打开
         self.cookiejar_unsafe = cookiejar_unsafe
+        self.chunk_size = kwargs.get("chunk_size", 64 * 1024)
+        # 连接池配置
+        self.limit = kwargs.get("limit", 100)
+        self.limit_per_host = kwargs.get("limit_per_host", 0)
+        self.keepalive_timeout = kwargs.get("keepalive_timeout", 15)
+        self.dns_cache_ttl = kwargs.get("dns_cache_ttl", 10)
+        self.async_resolver = kwargs.get("async_resolver", False)
+        self.retry_policy: Optional[RetryPolicy] = kwargs.get("retry_policy")
+        self.circuit_breaker: Union[bool, Dict, None] = kwargs.get("circuit_breaker")
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self.response_cache: Optional[HttpCache] = self._create_response_cache(kwargs.get("response_cache"))
+        self.single_flight = kwargs.get("single_flight", False)
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.hedge_policy: Optional[HedgePolicy] = kwargs.get("hedge_policy")
+        self.trace_metrics = kwargs.get("trace_metrics", True)
+        self.http_metrics = HttpMetrics()
+        self.rate_limits: Dict[str, Dict] = kwargs.get("rate_limits") or {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self.host_timeouts: Dict[str, TimeoutType] = kwargs.get("host_timeouts") or {}
+        self.compress_request: Optional[str] = self._verify_compress_request(kwargs.get("compress_request"))
+        self.compress_threshold = kwargs.get("compress_threshold", 1024 * 1024)
+        self.compress_offload_threshold = kwargs.get("compress_offload_threshold", 4 * 1024 * 1024)
+        self.accept_compressed = kwargs.get("accept_compressed", True)
+        self.json_decoder: Optional[Callable] = kwargs.get("json_decoder")
+        self.decode_offload_threshold = kwargs.get("decode_offload_threshold", 1024 * 1024)
+        self.profiles: Dict[str, Dict] = kwargs.get("profiles") or {}
+        self._profiles: Dict[str, "AIOHttpClient"] = {}
+        self.warmup_targets: List[Union[str, Dict]] = kwargs.get("warmup_targets") or []
+        self.warmup_connections = kwargs.get("warmup_connections", 2)
+        self.warmup_timeout = kwargs.get("warmup_timeout", 5)
 
         if app is not None:
             self.init_app(app, timeout=self.timeout, verify_ssl=self.verify_ssl, message=self.message,
-                          use_zh=self.use_zh)
+                          use_zh=self.use_zh, **kwargs)
 
-    def init_app(self, app, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                 use_zh: bool = None):
+    def init_app(self, app, *, timeout: TimeoutType = None, verify_ssl: bool = None, message: Dict = None,
+                 use_zh: bool = None, **kwargs):
         """
         基于aiohttp的异步封装
         Args:
@@ -93,6 +349,7 @@ class AIOHttpClient(Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            kwargs: 其他配置,同__init__
         Returns:
 
         """
@@ -103,6 +360,55 @@ class AIOHttpClient(Singleton):
         use_zh = use_zh or app.config.get("ACLIENTS_HTTP_MSGZH", None) or self.use_zh
         self.message = verify_message(http_msg, message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
+        self.chunk_size = kwargs.get("chunk_size") or app.config.get(
+            "ACLIENTS_HTTP_CHUNK_SIZE", None) or self.chunk_size
+        self.limit = kwargs.get("limit") or app.config.get("ACLIENTS_HTTP_LIMIT", None) or self.limit
+        self.limit_per_host = kwargs.get("limit_per_host") or app.config.get(
+            "ACLIENTS_HTTP_LIMIT_PER_HOST", None) or self.limit_per_host
+        self.keepalive_timeout = kwargs.get("keepalive_timeout") or app.config.get(
+            "ACLIENTS_HTTP_KEEPALIVE_TIMEOUT", None) or self.keepalive_timeout
+        self.dns_cache_ttl = kwargs.get("dns_cache_ttl") or app.config.get(
+            "ACLIENTS_HTTP_DNS_CACHE_TTL", None) or self.dns_cache_ttl
+        self.async_resolver = kwargs.get("async_resolver") or app.config.get(
+            "ACLIENTS_HTTP_ASYNC_RESOLVER", None) or self.async_resolver
+        self.retry_policy = kwargs.get("retry_policy") or app.config.get(
+            "ACLIENTS_HTTP_RETRY_POLICY", None) or self.retry_policy
+        self.circuit_breaker = kwargs.get("circuit_breaker") or app.config.get(
+            "ACLIENTS_HTTP_CIRCUIT_BREAKER", None) or self.circuit_breaker
+        self.response_cache = self._create_response_cache(kwargs.get("response_cache") or app.config.get(
+            "ACLIENTS_HTTP_RESPONSE_CACHE", None)) or self.response_cache
+        self.single_flight = kwargs.get("single_flight") or app.config.get(
+            "ACLIENTS_HTTP_SINGLE_FLIGHT", None) or self.single_flight
+        self.hedge_policy = kwargs.get("hedge_policy") or app.config.get(
+            "ACLIENTS_HTTP_HEDGE_POLICY", None) or self.hedge_policy
+        # 布尔配置为False时也需要生效
+        trace_metrics = kwargs.get("trace_metrics", app.config.get("ACLIENTS_HTTP_TRACE_METRICS", None))
+        self.trace_metrics = self.trace_metrics if trace_metrics is None else trace_metrics
+        self.rate_limits = kwargs.get("rate_limits") or app.config.get(
+            "ACLIENTS_HTTP_RATE_LIMITS", None) or self.rate_limits
+        self.host_timeouts = kwargs.get("host_timeouts") or app.config.get(
+            "ACLIENTS_HTTP_HOST_TIMEOUTS", None) or self.host_timeouts
+        self.compress_request = self._verify_compress_request(kwargs.get("compress_request") or app.config.get(
+            "ACLIENTS_HTTP_COMPRESS_REQUEST", None)) or self.compress_request
+        self.compress_threshold = kwargs.get("compress_threshold") or app.config.get(
+            "ACLIENTS_HTTP_COMPRESS_THRESHOLD", None) or self.compress_threshold
+        self.compress_offload_threshold = kwargs.get("compress_offload_threshold") or app.config.get(
+            "ACLIENTS_HTTP_COMPRESS_OFFLOAD_THRESHOLD", None) or self.compress_offload_threshold
+        # 布尔配置为False时也需要生效
+        accept_compressed = kwargs.get("accept_compressed", app.config.get("ACLIENTS_HTTP_ACCEPT_COMPRESSED", None))
+        self.accept_compressed = self.accept_compressed if accept_compressed is None else accept_compressed
+        self.json_decoder = kwargs.get("json_decoder") or app.config.get(
+            "ACLIENTS_HTTP_JSON_DECODER", None) or self.json_decoder
+        self.decode_offload_threshold = kwargs.get("decode_offload_threshold") or app.config.get(
+            "ACLIENTS_HTTP_DECODE_OFFLOAD_THRESHOLD", None) or self.decode_offload_threshold
+        self.warmup_targets = kwargs.get("warmup_targets") or app.config.get(
+            "ACLIENTS_HTTP_WARMUP_TARGETS", None) or self.warmup_targets
+        self.warmup_connections = kwargs.get("warmup_connections") or app.config.get(
+            "ACLIENTS_HTTP_WARMUP_CONNECTIONS", None) or self.warmup_connections
+        self.warmup_timeout = kwargs.get("warmup_timeout") or app.config.get(
+            "ACLIENTS_HTTP_WARMUP_TIMEOUT", None) or self.warmup_timeout
+        self.profiles = kwargs.get("profiles") or app.config.get("ACLIENTS_HTTP_PROFILES", None) or self.profiles
+        self._profiles = {name: self._create_profile(options) for name, options in self.profiles.items()}
 
         @app.listener('before_server_start')
         async def open_connection(app_, loop):
@@ -113,8 +419,10 @@ class AIOHttpClient(Singleton):
             Returns:
 
             """
-            jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
-            self.session = aiohttp.ClientSession(cookie_jar=jar)
+            for client in self._all_clients():
+                client.session = client._create_session()
+            # 在接收请求之前预热连接池
+            await asyncio.gather(*(client.warm_up() for client in self._all_clients()))
 
         @app.listener('after_server_stop')
         async def close_connection(app_, loop):
@@ -125,11 +433,12 @@ class AIOHttpClient(Singleton):
             Returns:
 
             """
-            if self.session:
-                await self.session.close()
+            for client in self._all_clients():
+                if client.session:
+                    await client.session.close()
 
-    def init_session(self, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                     use_zh: bool = None):
+    def init_session(self, *, timeout: TimeoutType = None, verify_ssl: bool = None, message: Dict = None,
+                     use_zh: bool = None, **kwargs):
         """
         基于aiohttp的异步封装
         Args:
@@ -137,6 +446,7 @@ class AIOHttpClient(Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            kwargs: 其他配置,同__init__
         Returns:
 
         """
@@ -145,6 +455,31 @@ class AIOHttpClient(Singleton):
         use_zh = use_zh or self.use_zh
         self.message = verify_message(http_msg, message or self.message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
+        self.chunk_size = kwargs.get("chunk_size") or self.chunk_size
+        self.limit = kwargs.get("limit") or self.limit
+        self.limit_per_host = kwargs.get("limit_per_host") or self.limit_per_host
+        self.keepalive_timeout = kwargs.get("keepalive_timeout") or self.keepalive_timeout
+        self.dns_cache_ttl = kwargs.get("dns_cache_ttl") or self.dns_cache_ttl
+        self.async_resolver = kwargs.get("async_resolver") or self.async_resolver
+        self.retry_policy = kwargs.get("retry_policy") or self.retry_policy
+        self.circuit_breaker = kwargs.get("circuit_breaker") or self.circuit_breaker
+        self.response_cache = self._create_response_cache(kwargs.get("response_cache")) or self.response_cache
+        self.single_flight = kwargs.get("single_flight") or self.single_flight
+        self.hedge_policy = kwargs.get("hedge_policy") or self.hedge_policy
+        self.trace_metrics = kwargs.get("trace_metrics", self.trace_metrics)
+        self.rate_limits = kwargs.get("rate_limits") or self.rate_limits
+        self.host_timeouts = kwargs.get("host_timeouts") or self.host_timeouts
+        self.compress_request = self._verify_compress_request(kwargs.get("compress_request")) or self.compress_request
+        self.compress_threshold = kwargs.get("compress_threshold") or self.compress_threshold
+        self.compress_offload_threshold = kwargs.get("compress_offload_threshold") or self.compress_offload_threshold
+        self.accept_compressed = kwargs.get("accept_compressed", self.accept_compressed)
+        self.json_decoder = kwargs.get("json_decoder") or self.json_decoder
+        self.decode_offload_threshold = kwargs.get("decode_offload_threshold") or self.decode_offload_threshold
+        self.warmup_targets = kwargs.get("warmup_targets") or self.warmup_targets
+        self.warmup_connections = kwargs.get("warmup_connections") or self.warmup_connections
+        self.warmup_timeout = kwargs.get("warmup_timeout") or self.warmup_timeout
+        self.profiles = kwargs.get("profiles") or self.profiles
+        self._profiles = {name: self._create_profile(options) for name, options in self.profiles.items()}
         loop = asyncio.get_event_loop()
 
         async def open_connection():
@@ -155,8 +490,10 @@ class AIOHttpClient(Singleton):
             Returns:
 
             """
-            jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
-            self.session = aiohttp.ClientSession(cookie_jar=jar)
+            for client in self._all_clients():
+                client.session = client._create_session()
+            # 在接收请求之前预热连接池
+            await asyncio.gather(*(client.warm_up() for client in self._all_clients()))
 
         async def close_connection():
             """
@@ -166,137 +503,863 @@ class AIOHttpClient(Singleton):
             Returns:
 
             """
-            if self.session:
-                await self.session.close()
+            for client in self._all_clients():
+                if client.session:
+                    await client.session.close()
 
         loop.run_until_complete(open_connection())
         atexit.register(lambda: loop.run_until_complete(close_connection()))
 
-    async def _request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
-                       json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                       **kwargs) -> AsyncResponse:
+    @classmethod
+    def get(cls, name: str = None) -> "AIOHttpClient":
         """
+        获取命名的客户端, 不同名称的客户端使用独立的session, 慢的请求不会占用快的请求的连接池
 
+        internal = AIOHttpClient.get("internal")
+        await internal.async_get(url)
         Args:
-            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            name: profiles中配置的名称, 为空或者default时返回默认的客户端
         Returns:
 
         """
+        client = cls()
+        if not name or name == "default":
+            return client
+        if name not in client._profiles:
+            raise ConfigError("AIOHttpClient profile {} is not configured".format(name))
+        return client._profiles[name]
+
+    def _create_profile(self, options: Dict) -> "AIOHttpClient":
+        """
+        创建命名的客户端, 绕过Singleton创建新的实例
+        Args:
+            options: 同__init__的参数
+        Returns:
 
-        async def _async_get():
-            """
+        """
+        options = dict(options)
+        message, use_zh = options.pop("message", None), options.pop("use_zh", None)
+        profile = self.__class__.__new__(self.__class__)
+        profile.__init__(timeout=options.pop("timeout", self.timeout),
+                         verify_ssl=options.pop("verify_ssl", self.verify_ssl),
+                         cookiejar_unsafe=options.pop("cookiejar_unsafe", self.cookiejar_unsafe), **options)
+        profile.message = verify_message(http_msg, message) if message else self.message
+        profile.msg_zh = self.msg_zh if use_zh is None else ("msg_zh" if use_zh else "msg_en")
+        return profile
+
+    def _all_clients(self, ) -> List["AIOHttpClient"]:
+        """
+        当前客户端以及所有命名的客户端
+        Args:
 
-            Args:
+        Returns:
 
-            Returns:
+        """
+        return [self, *self._profiles.values()]
 
-            """
-            return await self.session.get(url, params=params, headers=headers, timeout=timeout, verify_ssl=verify_ssl,
-                                          **kwargs)
+    @staticmethod
+    def _create_response_cache(response_cache: Union[bool, Dict, HttpCache, None]) -> Optional[HttpCache]:
+        """
+        根据配置创建响应缓存
+        Args:
+            response_cache: True使用默认配置, 字典为HttpCache的参数, 也可以直接是HttpCache实例
+        Returns:
 
-        async def _async_post():
-            """
+        """
+        if not response_cache or isinstance(response_cache, HttpCache):
+            return response_cache or None
+        return HttpCache(**response_cache) if isinstance(response_cache, MutableMapping) else HttpCache()
 
-            Args:
+    @staticmethod
+    def _verify_compress_request(compress_request: Optional[str]) -> Optional[str]:
+        """
+        校验请求体的压缩方式, 只支持gzip和deflate
+        Args:
+            compress_request: 压缩方式
+        Returns:
+            小写的压缩方式
+        """
+        if not compress_request:
+            return None
+        if not isinstance(compress_request, str) or compress_request.lower() not in ("gzip", "deflate"):
+            raise ConfigError("compress_request must be gzip or deflate, not {!r}".format(compress_request))
+        return compress_request.lower()
 
-            Returns:
+    def _create_session(self, ) -> aiohttp.ClientSession:
+        """
+        按照连接池配置创建session, 需要在事件循环中调用
+        Args:
 
-            """
-            res = await self.session.post(url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                          verify_ssl=verify_ssl, **kwargs)
-            return res
+        Returns:
 
-        async def _async_put():
-            """
+        """
+        resolver = None
+        if self.async_resolver:
+            try:
+                resolver = aiohttp.AsyncResolver()
+            except RuntimeError as e:  # 没有安装aiodns
+                aelog.warning("aiodns resolver is unavailable, use default resolver. {}".format(e))
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=self.dns_cache_ttl,
+                                         use_dns_cache=True, resolver=resolver)
+        jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
+        trace_configs = [self.http_metrics.trace_config()] if self.trace_metrics else None
+        # aiohttp默认发送Accept-Encoding: gzip, deflate并自动解压
+        headers = None if self.accept_compressed else {"Accept-Encoding": "identity"}
+        return aiohttp.ClientSession(connector=connector, cookie_jar=jar, trace_configs=trace_configs,
+                                     headers=headers)
+
+    async def warm_up(self, targets: List[Union[str, Dict]] = None) -> Dict[str, int]:
+        """
+        预热连接池, 对每个目标同时发送多个HEAD请求, 完成DNS解析和TCP/TLS握手, 请求完成后连接保留在连接池中
 
-            Args:
+        连接空闲超过keepalive_timeout后会被关闭, 预热的连接数也受limit和limit_per_host的限制, 预热失败只记录日志
+        Args:
+            targets: 预热的目标, url或者{"url": url, "connections": 连接数}的列表, 默认为warmup_targets
+        Returns:
+            {url: 成功的请求数}
+        """
+        targets = self.warmup_targets if targets is None else targets
+        if not targets or self.session is None:
+            return {}
+        timeout = aiohttp.ClientTimeout(total=self.warmup_timeout)
 
-            Returns:
+        async def _warm_up_one(url: str) -> bool:
+            try:
+                async with self.session.request("HEAD", url, timeout=timeout, verify_ssl=self.verify_ssl):
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                aelog.warning("Warm up {} failed, {}".format(url, str(e) or repr(e)))
+                return False
+
+        urls, tasks = [], []
+        for target in targets:
+            target = {"url": target} if isinstance(target, str) else target
+            connections = target.get("connections") or self.warmup_connections
+            urls.extend([target["url"]] * connections)
+            tasks.extend(_warm_up_one(target["url"]) for _ in range(connections))
+        result = {}
+        for url, succeeded in zip(urls, await asyncio.gather(*tasks)):
+            result[url] = result.get(url, 0) + succeeded
+        return result
+
+    def metrics_snapshot(self, ) -> Dict[str, Dict]:
+        """
+        按host统计的请求各个阶段的耗时以及新建和复用的连接数
+        Args:
 
-            """
-            return await self.session.put(url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                          verify_ssl=verify_ssl, **kwargs)
+        Returns:
 
-        async def _async_patch():
-            """
+        """
+        return self.http_metrics.snapshot()
 
-            Args:
+    async def _send_request(self, method: str, url: str, *, params: Dict = None, data: DataType = None,
+                            json: Dict = None, headers: Dict = None, timeout: TimeoutType = None,
+                            verify_ssl: bool = None, record_success: bool = True, **kwargs) -> aiohttp.ClientResponse:
+        """
+        发送请求,返回还未读取响应体的响应对象,并且统一转换aiohttp的异常
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            record_success: 收到响应头时是否向熔断器记录成功, 为False时由调用方读取响应体后记录
+        Returns:
 
-            Returns:
+        """
+        if method.upper() not in ("GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"):
+            raise ClientError(url=url, message="error method '{0}'".format(method.upper()))
+        rate_limiter = self._get_rate_limiter(url)
+        if rate_limiter is not None:
+            await rate_limiter.acquire(url)
+        breaker = self._get_circuit_breaker(url)
+        if breaker is not None and not breaker.allow_request():
+            raise CircuitOpenError(url=url, message="circuit breaker is open, host={}".format(urlsplit(url).netloc))
+
+        timeout = self._get_timeout(url, timeout)
+        try:
+            send = self.session.request(method.upper(), url, params=params, data=data, json=json, headers=headers,
+                                        timeout=timeout.to_client_timeout(), verify_ssl=verify_ssl, **kwargs)
+            # session.request在收到响应头后返回, 所以首字节超时可以直接限制它的等待时间
+            resp = await (asyncio.wait_for(send, timeout.first_byte) if timeout.first_byte else send)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if breaker is not None:
+                breaker.record(True)
+            raise ClientConnectionError(url=url, message=str(e) or repr(e))
+        except aiohttp.ClientError as e:
+            if breaker is not None:
+                breaker.record(False)
+            raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+        # 服务端错误计为失败, 客户端错误说明上游是正常的
+        if breaker is not None and (resp.status >= 500 or record_success):
+            breaker.record(resp.status >= 500)
 
-            """
-            return await self.session.patch(url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                            verify_ssl=verify_ssl, **kwargs)
+        # 不使用raise_for_status, 新版本的aiohttp在抛出异常前会释放连接, 导致无法读取错误响应体
+        if resp.status >= 400:
+            async with resp:
+                try:
+                    resp_data = (await self._decode_response(self._make_response(resp, await resp.read()))).resp_body
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    resp_data = ""
+            raise ClientResponseError(url=url, status_code=resp.status, message=resp.reason, headers=resp.headers,
+                                      body=resp_data)
+        return resp
 
-        async def _async_delete():
-            """
+    def _get_timeout(self, url: str, timeout: TimeoutType = None) -> HttpTimeout:
+        """
+        合并客户端、host和本次请求的超时配置, 优先级依次升高
+        Args:
+            url: 请求的url
+            timeout: 本次请求的超时
+        Returns:
 
-            Args:
+        """
+        result = HttpTimeout.from_value(self.timeout) or HttpTimeout()
+        if self.host_timeouts:
+            result = result.merge(HttpTimeout.from_value(self.host_timeouts.get(urlsplit(url).netloc)))
+        return result.merge(HttpTimeout.from_value(timeout))
 
-            Returns:
+    def _get_rate_limiter(self, url: str) -> Optional[RateLimiter]:
+        """
+        获取url对应的限流器, 先按照host匹配, 再按照顺序用正则匹配url, 没有匹配时返回None
+        Args:
+            url: 请求的url
+        Returns:
 
-            """
-            return await self.session.delete(url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                             verify_ssl=verify_ssl, **kwargs)
+        """
+        if not self.rate_limits:
+            return None
+        host = urlsplit(url).netloc
+        if host in self.rate_limits:
+            key = host
+        else:
+            key = next((pattern for pattern in self.rate_limits if re.match(pattern, url)), None)
+            if key is None:
+                return None
+        if key not in self._rate_limiters:
+            self._rate_limiters[key] = RateLimiter(**self.rate_limits[key])
+        return self._rate_limiters[key]
+
+    def rate_limit_stats(self, ) -> Dict[str, Dict]:
+        """
+        所有限流器的统计, 包括当前等待的请求数和累计等待的时间
+        Args:
+
+        Returns:
+
+        """
+        return {key: limiter.snapshot() for key, limiter in self._rate_limiters.items()}
 
-        get_resp = {"GET": _async_get, "POST": _async_post, "PUT": _async_put, "DELETE": _async_delete,
-                    "PATCH": _async_patch}
-        resp = None
+    def _get_circuit_breaker(self, url: str) -> Optional[CircuitBreaker]:
+        """
+        获取url的host对应的熔断器, 没有配置熔断时返回None
+        Args:
+            url: 请求的url
+        Returns:
+
+        """
+        if not self.circuit_breaker:
+            return None
+        host = urlsplit(url).netloc
+        if host not in self._circuit_breakers:
+            options = self.circuit_breaker if isinstance(self.circuit_breaker, MutableMapping) else {}
+            self._circuit_breakers[host] = CircuitBreaker(**options)
+        return self._circuit_breakers[host]
+
+    def circuit_breaker_states(self, ) -> Dict[str, Dict]:
+        """
+        所有host的熔断器状态, 用于健康检查
+        Args:
+
+        Returns:
+            {host: {"state": "closed", "requests": 0, "failures": 0, "failure_rate": 0.0}}
+        """
+        return {host: breaker.snapshot() for host, breaker in self._circuit_breakers.items()}
+
+    async def _compress_body(self, kwargs: Dict) -> Dict:
+        """
+        压缩超过compress_threshold的json或者bytes请求体, 超过compress_offload_threshold时在线程池中压缩
+        Args:
+            kwargs: 请求的参数
+        Returns:
+            替换了请求体的请求参数
+        """
+        data, json = kwargs.get("data"), kwargs.get("json")
+        # 调用方的请求头名称可能是任意大小写
+        headers = CIMultiDict(kwargs.get("headers") or {})
+        if json is not None:
+            body = json_dumps(json).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(data, (bytes, bytearray, str)):
+            body = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        else:  # 表单和流式的请求体不压缩
+            return kwargs
+        if len(body) < self.compress_threshold or "Content-Encoding" in headers:
+            return kwargs
+
+        compress = (partial(gzip.compress, compresslevel=6) if self.compress_request == "gzip" else
+                    partial(zlib.compress, level=6))
+        if len(body) >= self.compress_offload_threshold:
+            body = await wrap_async_func(compress, body)
+        else:
+            body = compress(body)
+        headers["Content-Encoding"] = self.compress_request
+        return dict(kwargs, data=body, json=None, headers=headers)
+
+    @staticmethod
+    def _open_upload(url: str, kwargs: Dict) -> Tuple[Dict, List[IO]]:
+        """
+        打开上传的文件, 文件路径转换为文件对象, files转换为multipart的FormData, aiohttp发送时按块读取文件
+        Args:
+            url: 请求的url
+            kwargs: 请求的参数
+        Returns:
+            (替换了请求体的请求参数, 打开的文件对象), 请求结束后需要关闭打开的文件对象
+        """
+        kwargs = dict(kwargs)
+        data, files = kwargs.get("data"), kwargs.pop("files", None)
+        opened: List[IO] = []
         try:
-            resp = await get_resp[method.upper()]()
-            resp.raise_for_status()
-        except KeyError as e:
-            raise ClientError(url=url, message="error method {0}".format(str(e)))
-        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
-            raise ClientConnectionError(url=url, message=str(e))
-        except aiohttp.ClientResponseError as e:
+            if isinstance(data, os.PathLike):
+                data = open(data, "rb")
+                opened.append(data)
+            if files:
+                if data is not None and not isinstance(data, MutableMapping):
+                    raise ClientError(url=url, message="data must be a dict when files is given")
+                form = aiohttp.FormData()
+                for name, value in (data or {}).items():
+                    form.add_field(name, str(value))
+                for name, value in files.items():
+                    # 值可以是文件路径、文件对象、bytes或者(filename, 文件, content_type)
+                    filename, content, content_type = value if isinstance(value, tuple) else (None, value, None)
+                    if isinstance(content, (str, os.PathLike)):
+                        filename = filename or os.path.basename(content)
+                        content = open(content, "rb")
+                        opened.append(content)
+                    form.add_field(name, content, filename=filename or name, content_type=content_type)
+                data = form
+        except OSError as e:
+            for f in opened:
+                f.close()
+            raise ClientError(url=url, message="open upload file error: {}".format(e))
+        except ClientError:
+            for f in opened:
+                f.close()
+            raise
+        kwargs["data"] = data
+        return kwargs, opened
+
+    async def _request_upload(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """
+        发送流式的请求体, 请求体只能读取一次, 所以不缓存、不重试也不对冲
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, files=None, **kwargs
+        Returns:
+
+        """
+        kwargs, opened = self._open_upload(url, kwargs)
+        try:
+            return await self._request_once(method, url, **kwargs)
+        finally:
+            for f in opened:
+                f.close()
+
+    async def _request(self, method: str, url: str, *, use_cache: bool = True, **kwargs) -> AsyncResponse:
+        """
+        发送请求, 开启了响应缓存时GET请求先查缓存
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            use_cache: 开启了响应缓存时本次请求是否使用缓存
+        Returns:
+
+        """
+        data = kwargs.get("data")
+        if kwargs.get("files") or isinstance(data, os.PathLike) or _is_stream_body(data):
+            return await self._request_upload(method, url, **kwargs)
+        kwargs.pop("files", None)
+        if self.compress_request:
+            kwargs = await self._compress_body(kwargs)
+        cache = self.response_cache
+        if cache is None or not use_cache or method.upper() != "GET":
+            return await self._fetch(method, url, **kwargs)
+
+        key = cache.make_key(url, kwargs.get("params"), kwargs.get("headers"))
+        if key is None:
+            return await self._fetch(method, url, **kwargs)
+        entry = cache.get(key)
+        if entry is not None and entry.is_fresh:
+            cache.hits += 1
+            return entry.response
+        if entry is not None:  # 过期的响应带上验证器重新验证
+            headers = CIMultiDict(kwargs.get("headers") or {})
+            headers.update(entry.validators())
+            kwargs["headers"] = headers
+
+        resp = await self._fetch(method, url, **kwargs)
+        if entry is not None and resp.status_code == 304:
+            return cache.revalidate(key, entry, resp.headers).response
+        cache.misses += 1
+        cache.store(key, resp)
+        return resp
+
+    async def _fetch(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """
+        开启了single_flight时, 相同的GET/HEAD请求同时只发送一个, 所有的调用方共享同一个AsyncResponse
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        if (not self.single_flight or method.upper() not in ("GET", "HEAD") or
+                kwargs.get("data") is not None or kwargs.get("json") is not None):
+            return await self._request_with_retry(method, url, **kwargs)
+
+        key = HttpCache.make_key(url, kwargs.get("params"), kwargs.get("headers"))
+        if key is None:
+            return await self._request_with_retry(method, url, **kwargs)
+        key = (method.upper(),) + key
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request_with_retry(method, url, **kwargs))
+            self._inflight[key] = task
+
+            def _done(task_: asyncio.Future):
+                if self._inflight.get(key) is task_:
+                    self._inflight.pop(key)
+                if not task_.cancelled():  # 所有调用方都取消时, 避免异常没有被获取的警告
+                    task_.exception()
+
+            task.add_done_callback(_done)
+        # 单个调用方取消时不影响其他等待的调用方
+        return await asyncio.shield(task)
+
+    async def _request_with_retry(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """
+        发送请求, 配置了重试策略时按照策略重试
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        if self.retry_policy is None:
+            return await self._request_hedged(method, url, **kwargs)
+
+        self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
             try:
-                resp_data = await resp.json() if resp else ""
-            except (ValueError, TypeError, aiohttp.ContentTypeError):
-                resp_data = await resp.text() if resp else ""
-            raise ClientResponseError(url=url, status_code=e.status, message=e.message, headers=e.headers,
-                                      body=resp_data)
-        except aiohttp.ClientError as e:
-            raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+                return await self._request_hedged(method, url, **kwargs)
+            except ClientError as e:
+                delay = self.retry_policy.get_retry_delay(method, attempt, e)
+                if delay is None:
+                    raise
+                aelog.info("Retry {} {} after {:.3f}s, attempt {}, error: {}".format(
+                    method.upper(), url, delay, attempt + 1, e))
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _request_hedged(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """
+        配置了对冲策略时, 幂等请求等待一段时间没有响应则再发送一个相同的请求, 使用先成功的响应
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        policy = self.hedge_policy
+        if policy is None:
+            return await self._request_once(method, url, **kwargs)
+        host = urlsplit(url).netloc
+        delay = policy.get_delay(method, host)
+        if delay is None and method.upper() not in policy.hedge_methods:
+            return await self._request_once(method, url, **kwargs)
+
+        policy.requests += 1
+        loop = asyncio.get_event_loop()
+        start_time = loop.time()
+        primary = asyncio.ensure_future(self._request_once(method, url, **kwargs))
+        pending = {primary}
+        try:
+            if delay is not None:
+                await asyncio.wait(pending, timeout=delay)
+                if not primary.done() and policy.allow_hedge():
+                    pending.add(asyncio.ensure_future(self._request_once(method, url, **kwargs)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_error = task.exception()
+                    if task_error is None:
+                        return task.result()
+                    # 客户端错误是确定的结果, 不需要等待另一个请求
+                    if isinstance(task_error, ClientResponseError) and task_error.status_code < 500:
+                        raise task_error
+                    error = error or task_error
+            raise error
+        finally:
+            # 每个请求都统计耗时, 包括失败的请求, 对冲请求先完成时主请求的耗时不会小于已经经过的时间, 作为下限统计,
+            # 否则慢的主请求不会被统计, 分位数会越来越小
+            policy.record_latency(host, loop.time() - start_time)
+            for task in pending:
+                task.cancel()
+
+    async def _request_once(self, method: str, url: str, *, params: Dict = None, data: DataType = None,
+                            json: Dict = None, headers: Dict = None, timeout: TimeoutType = None,
+                            verify_ssl: bool = None, **kwargs) -> AsyncResponse:
+        """
+
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        # 响应头之后读取响应体也可能超时或者断开, 读取完成后才向熔断器记录结果
+        resp = await self._send_request(method, url, params=params, data=data, json=json, headers=headers,
+                                        timeout=timeout, verify_ssl=verify_ssl, record_success=False, **kwargs)
+        breaker = self._get_circuit_breaker(url)
 
         async with resp:
             try:
-                resp_json = await resp.json()
-            except (ValueError, TypeError, aiohttp.ContentTypeError):
-                try:
-                    resp_text = await resp.text()
-                except (ValueError, TypeError):
-                    try:
-                        resp_bytes = await resp.read()
-                    except (aiohttp.ClientResponseError, aiohttp.ClientError) as e:
-                        aelog.exception(e)
-                        raise HttpError(e.code, message=self.message[200][self.msg_zh], error=e)
-                    else:
-                        return AsyncResponse(resp.status, resp.reason, resp.headers, resp.cookies, resp_body="",
-                                             content=resp_bytes)
-                else:
-                    return AsyncResponse(resp.status, resp.reason, resp.headers, resp.cookies, resp_body=resp_text,
-                                         content=b"")
-            else:
-                return AsyncResponse(resp.status, resp.reason, resp.headers, resp.cookies, resp_body=resp_json,
-                                     content=b"")
+                resp_bytes = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if breaker is not None:
+                    breaker.record(True)
+                aelog.exception(e)
+                raise HttpError(getattr(e, "status", 500), message=self.message[200][self.msg_zh], error=e)
+        if breaker is not None:
+            breaker.record(False)
+        return await self._decode_response(self._make_response(resp, resp_bytes))
+
+    def _make_response(self, resp: aiohttp.ClientResponse, resp_bytes: bytes) -> AsyncResponse:
+        """
+        用读取的响应体构造AsyncResponse, 响应体的解码延迟到第一次访问
+        Args:
+            resp: aiohttp的响应对象
+            resp_bytes: 原始的响应体
+        Returns:
 
-    async def async_request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
-                            json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                            **kwargs) -> AsyncResponse:
         """
+        return AsyncResponse(resp.status, resp.reason, resp.headers, resp.cookies, content=resp_bytes,
+                             content_type=resp.content_type, charset=resp.charset, json_decoder=self.json_decoder)
 
+    async def _decode_response(self, response: AsyncResponse) -> AsyncResponse:
+        """
+        超过decode_offload_threshold的json和文本响应体在线程池中解码, 避免阻塞事件循环, 小的响应体仍然延迟解码
         Args:
+            response: 还未解码的响应
+        Returns:
 
+        """
+        if len(response.content) >= self.decode_offload_threshold and _is_text_type(response.content_type):
+            response._resp_body = await wrap_async_func(response._decode_body)
+        return response
+
+    async def _stream(self, method: str, url: str, *, chunk_size: int = None, **kwargs) -> AsyncIterator[bytes]:
+        """
+        流式读取响应体,每次只从连接中读取chunk_size大小的数据
+        Args:
+            method, url, *, chunk_size=None, **kwargs
+        Returns:
+
+        """
+        chunk_size = chunk_size or self.chunk_size
+        kwargs, opened = self._open_upload(url, kwargs)
+        try:
+            if self.compress_request:
+                kwargs = await self._compress_body(kwargs)
+            resp = await self._send_request(method, url, **kwargs)
+
+            # 只有调用方消费了当前块才会继续读取socket, aiohttp的缓冲区满后会暂停读取,内存占用不会随响应体增长
+            async with resp:
+                try:
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        yield chunk
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    raise ClientConnectionError(url=url, message=str(e) or repr(e))
+                except aiohttp.ClientError as e:
+                    raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+        finally:
+            for f in opened:
+                f.close()
+
+    async def async_request(self, method: str, url: str, *, params: Dict = None, data: DataType = None,
+                            json: Dict = None, headers: Dict = None, timeout: TimeoutType = None,
+                            verify_ssl: bool = None, stream: bool = False, chunk_size: int = None,
+                            files: Dict = None, **kwargs) -> Union[AsyncResponse, AsyncIterator[bytes]]:
+        """
+
+        Args:
+            data: 请求体, 文件对象、文件路径(os.PathLike)、异步生成器和FormData按块流式发送, 不会读取到内存中
+            stream: 是否流式读取响应体,为True时返回按块读取响应体的异步迭代器
+            chunk_size: 流式读取时每块的大小
+            files: multipart上传的文件, {字段名: 文件路径、文件对象、bytes或者(filename, 文件, content_type)},
+                   此时data为表单的其他字段
         Returns:
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
+        if stream:
+            return self._stream(method, url, chunk_size=chunk_size, params=params, data=data, json=json,
+                                headers=headers, timeout=timeout, verify_ssl=verify_ssl, files=files, **kwargs)
         return await self._request(method, url, params=params, data=data, json=json, headers=headers,
-                                   timeout=timeout, verify_ssl=verify_ssl, **kwargs)
+                                   timeout=timeout, verify_ssl=verify_ssl, files=files, **kwargs)
+
+    def async_stream(self, method: str, url: str, *, params: Dict = None, data: DataType = None, json: Dict = None,
+                     headers: Dict = None, timeout: TimeoutType = None, verify_ssl: bool = None, chunk_size: int = None,
+                     files: Dict = None, **kwargs) -> AsyncIterator[bytes]:
+        """
+        流式请求,返回按块读取响应体的异步迭代器,适用于下载大的响应体
+
+        async for chunk in client.async_stream("GET", url):
+            ...
+
+        迭代开始时才发送请求,迭代结束或者关闭迭代器时释放连接
+        Args:
+            chunk_size: 每块的大小,默认为初始化时的chunk_size
+            files: multipart上传的文件, 同async_request
+        Returns:
+
+        """
+        verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
+        return self._stream(method, url, chunk_size=chunk_size, params=params, data=data, json=json,
+                            headers=headers, timeout=timeout, verify_ssl=verify_ssl, files=files, **kwargs)
+
+    async def _probe_download(self, url: str, **kwargs) -> Tuple[Optional[int], Optional[str], bool]:
+        """
+        用HEAD请求获取下载文件的大小、ETag以及是否支持Range请求
+        Args:
+            url: 下载的url
+            kwargs: 请求的参数
+        Returns:
+            (Content-Length, ETag, 是否支持Range), 服务端不支持HEAD时为(None, None, False)
+        """
+        try:
+            resp = await self._send_request("HEAD", url, **kwargs)
+        except ClientResponseError:
+            return None, None, False
+        async with resp:
+            length = resp.headers.get("Content-Length")
+            length = int(length) if length and length.isdigit() else None
+            accept_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return length, resp.headers.get("ETag"), accept_ranges
 
-    async def async_get(self, url: str, *, params: Dict = None, headers: Dict = None, timeout: int = None,
+    async def _download_range(self, url: str, path: str, part: List[int], *, etag: str = None,
+                              chunk_size: int = None, headers: Dict = None, **kwargs):
+        """
+        下载文件的一段并写入到文件对应的位置, 写入后更新part中已经下载的字节数
+        Args:
+            url: 下载的url
+            path: 预分配好的文件路径
+            part: [开始位置, 结束位置, 已经下载的字节数], 包括结束位置
+            etag: 文件的ETag, 用于If-Range, 文件变化时服务端返回完整的响应
+        Returns:
+            服务端忽略了Range返回完整的响应时为False
+        """
+        start, end, _ = part
+        if start + part[2] > end:
+            return True
+        headers = dict(headers or {}, Range="bytes={}-{}".format(start + part[2], end))
+        # If-Range不能使用弱ETag, 否则服务端总是返回完整的响应
+        if etag and not etag.startswith("W/"):
+            headers["If-Range"] = etag
+        resp = await self._send_request("GET", url, headers=headers, **kwargs)
+        async with resp:
+            if resp.status == 200:
+                return False
+            if resp.status != 206:
+                raise ClientError(url=url, message="range request is not satisfied, the file may be changed, "
+                                                   "status={}".format(resp.status))
+            with open(path, "r+b") as f:
+                try:
+                    async for chunk in resp.content.iter_chunked(chunk_size or self.chunk_size):
+                        await wrap_async_func(_write_at, f, start + part[2], chunk)
+                        part[2] += len(chunk)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                    # 读取响应体时连接断开抛出的是ClientPayloadError
+                    raise ClientConnectionError(url=url, message=str(e) or repr(e))
+                except aiohttp.ClientError as e:
+                    raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+        if start + part[2] <= end:
+            raise ClientConnectionError(url=url, message="incomplete range {}-{}, received {} bytes".format(
+                start, end, part[2]))
+        return True
+
+    async def _download_single(self, url: str, path: str, *, offset: int = 0, chunk_size: int = None,
+                               headers: Dict = None, **kwargs):
+        """
+        单个连接流式下载文件, offset大于0时从offset处续传
+        Args:
+            url: 下载的url
+            path: 保存的文件路径
+            offset: 已经下载的字节数
+        Returns:
+
+        """
+        headers = dict(headers or {})
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+        resp = await self._send_request("GET", url, headers=headers, **kwargs)
+        async with resp:
+            # 服务端忽略Range返回200时从头下载
+            with open(path, "ab" if offset and resp.status == 206 else "wb") as f:
+                try:
+                    async for chunk in resp.content.iter_chunked(chunk_size or self.chunk_size):
+                        await wrap_async_func(f.write, chunk)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                    # 读取响应体时连接断开抛出的是ClientPayloadError
+                    raise ClientConnectionError(url=url, message=str(e) or repr(e))
+                except aiohttp.ClientError as e:
+                    raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+
+    async def async_download(self, url: str, path: str, *, parts: int = 4, params: Dict = None,
+                             headers: Dict = None, timeout: TimeoutType = None, verify_ssl: bool = None,
+                             chunk_size: int = None, min_part_size: int = 1024 * 1024, resume: bool = True,
+                             **kwargs) -> str:
+        """
+        下载文件到path, 响应体不会读取到内存中
+
+        服务端支持Range并且返回了Content-Length时, 预分配文件后把文件分成parts段并发下载, 每段写入文件对应的位置,
+        否则或者分段请求返回了完整的响应时使用单个连接流式下载. 下载的进度保存在path.download文件中, 下载失败后再次调用时从中断的位置续传,
+        续传时文件的大小或者ETag发生了变化则重新下载.
+        Args:
+            url: 下载的url
+            path: 保存的文件路径
+            parts: 并发下载的段数, 受连接池的limit_per_host限制
+            chunk_size: 每次写入文件的块大小
+            min_part_size: 每段的最小字节数, 文件小于两段时使用单个连接下载
+            resume: 是否从上次中断的位置续传
+        Returns:
+            保存的文件路径
+        """
+        verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
+        # 压缩的响应无法按照字节范围拼接, 下载时总是请求原始内容
+        headers = dict(headers or {}, **{"Accept-Encoding": "identity"})
+        kwargs = dict(kwargs, params=params, headers=headers, timeout=timeout, verify_ssl=verify_ssl)
+        length, etag, accept_ranges = await self._probe_download(url, **kwargs)
+        state_path = "{}.download".format(path)
+        state = await wrap_async_func(_load_download_state, state_path) if resume else None
+        if state and (state.get("url") != url or state.get("length") != length or state.get("etag") != etag or
+                      not os.path.exists(path)):
+            state = None
+
+        if not accept_ranges or not length or parts <= 1 or length < 2 * min_part_size:
+            # 分段下载的文件是预分配的, 文件大小不是已经下载的字节数
+            offset = os.path.getsize(path) if state and accept_ranges and not state.get("parts") else 0
+            if length is not None and offset == length:
+                await wrap_async_func(_remove_file, state_path)
+                return path
+            await wrap_async_func(_save_download_state, state_path, {"url": url, "length": length, "etag": etag})
+            await self._download_single(url, path, offset=offset, chunk_size=chunk_size, **kwargs)
+            await wrap_async_func(_remove_file, state_path)
+            return path
+
+        if state and state.get("parts"):
+            ranges = state["parts"]
+        else:
+            part_size = -(-length // parts)
+            ranges = [[start, min(start + part_size, length) - 1, 0] for start in range(0, length, part_size)]
+            await wrap_async_func(_preallocate_file, path, length)
+        state = {"url": url, "length": length, "etag": etag, "parts": ranges}
+        # 开始前和下载期间定期保存进度, 进程被杀掉后也可以续传
+        await wrap_async_func(_save_download_state, state_path, state)
+        stop_saving = asyncio.Event()
+
+        async def save_state():
+            while not stop_saving.is_set():
+                try:
+                    await asyncio.wait_for(stop_saving.wait(), DOWNLOAD_STATE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                await wrap_async_func(_save_download_state, state_path, state)
+
+        save_task = asyncio.ensure_future(save_state())
+        tasks = [asyncio.ensure_future(self._download_range(
+            url, path, part, etag=etag, chunk_size=chunk_size, **kwargs)) for part in ranges]
+        try:
+            for future in asyncio.as_completed(tasks):
+                if not await future:
+                    break
+            else:
+                stop_saving.set()
+                await save_task
+                await wrap_async_func(_remove_file, state_path)
+                return path
+        except BaseException:
+            # 一段失败时取消其他段, 保存已经下载的进度用于续传
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            stop_saving.set()
+            await save_task
+            raise
+
+        # 服务端对Range请求返回了完整的响应, 文件可能已经变化, 取消其他段后使用单个连接重新下载
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        stop_saving.set()
+        await save_task
+        aelog.warning("range request of {} is not satisfied, download it with a single connection".format(url))
+        await wrap_async_func(_save_download_state, state_path, {"url": url, "length": length, "etag": etag})
+        await self._download_single(url, path, chunk_size=chunk_size, **kwargs)
+        await wrap_async_func(_remove_file, state_path)
+        return path
+
+    async def async_request_many(self, requests: Iterable[Union[str, Dict]], *, concurrency: int = None,
+                                 concurrency_per_host: int = None
+                                 ) -> AsyncIterator[Tuple[int, Union[AsyncResponse, ClientError, HttpError]]]:
+        """
+        限制并发数的批量请求,按照完成的顺序返回结果
+
+        async for index, result in client.async_request_many([url, {"method": "POST", "url": url, "json": {}}]):
+            if isinstance(result, ClientError):
+                ...
+
+        单个请求失败时返回对应的异常,不会中断整个批量请求
+        Args:
+            requests: 请求的描述, url字符串表示GET请求, 字典中method默认为GET, url之外的键值为async_request的参数
+            concurrency: 全局的并发数,默认为连接池的limit
+            concurrency_per_host: 每个host的并发数,默认为连接池的limit_per_host, 0不限制
+        Returns:
+            (请求在requests中的索引, AsyncResponse或者异常)
+        """
+        concurrency = concurrency or self.limit or 100
+        concurrency_per_host = concurrency_per_host or self.limit_per_host
+        host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+        async def _request_one(index: int, request: Union[str, Dict]):
+            """
+            执行单个请求,异常作为结果返回
+            """
+            request = {"url": request} if isinstance(request, str) else dict(request)
+            method, url = request.pop("method", "GET"), request.pop("url")
+            try:
+                if concurrency_per_host:
+                    host = urlsplit(url).netloc
+                    if host not in host_semaphores:
+                        host_semaphores[host] = asyncio.Semaphore(concurrency_per_host)
+                    async with host_semaphores[host]:
+                        return index, await self.async_request(method, url, **request)
+                return index, await self.async_request(method, url, **request)
+            except (ClientError, HttpError) as e:
+                return index, e
+
+        # 同时存在的任务数不超过concurrency, 完成一个才从requests中取下一个, 避免一次创建大量的任务
+        pending = set()
+        try:
+            for index, request in enumerate(requests):
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.ensure_future(_request_one(index, request)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # 调用方提前结束迭代时取消还未完成的请求
+            for task in pending:
+                task.cancel()
+
+    async def async_get(self, url: str, *, params: Dict = None, headers: Dict = None, timeout: TimeoutType = None,
                         verify_ssl: bool = None, **kwargs) -> AsyncResponse:
         """
 
@@ -306,57 +1369,56 @@ class AIOHttpClient(Singleton):
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
         return await self._request("GET", url, params=params, headers=headers, timeout=timeout, verify_ssl=verify_ssl,
                                    **kwargs)
 
-    async def async_post(self, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
-                         headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                         **kwargs) -> AsyncResponse:
+    async def async_post(self, url: str, *, params: Dict = None, data: DataType = None, json: Dict = None,
+                         headers: Dict = None, timeout: TimeoutType = None, verify_ssl: bool = None,
+                         files: Dict = None, **kwargs) -> AsyncResponse:
         """
 
         Args:
-
+            data: 请求体, 文件对象、文件路径(os.PathLike)、异步生成器和FormData按块流式发送
+            files: multipart上传的文件, 同async_request
         Returns:
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
         return await self._request("POST", url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                   verify_ssl=verify_ssl, **kwargs)
+                                   verify_ssl=verify_ssl, files=files, **kwargs)
 
-    async def async_put(self, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
-                        headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                        **kwargs) -> AsyncResponse:
+    async def async_put(self, url: str, *, params: Dict = None, data: DataType = None, json: Dict = None,
+                        headers: Dict = None, timeout: TimeoutType = None, verify_ssl: bool = None,
+                        files: Dict = None, **kwargs) -> AsyncResponse:
         """
 
         Args:
-
+            data: 请求体, 文件对象、文件路径(os.PathLike)、异步生成器和FormData按块流式发送
+            files: multipart上传的文件, 同async_request
         Returns:
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
         return await self._request("PUT", url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                   verify_ssl=verify_ssl, **kwargs)
+                                   verify_ssl=verify_ssl, files=files, **kwargs)
 
-    async def async_patch(self, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
-                          headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                          **kwargs) -> AsyncResponse:
+    async def async_patch(self, url: str, *, params: Dict = None, data: DataType = None, json: Dict = None,
+                          headers: Dict = None, timeout: TimeoutType = None, verify_ssl: bool = None,
+                          files: Dict = None, **kwargs) -> AsyncResponse:
         """
 
         Args:
-
+            data: 请求体, 文件对象、文件路径(os.PathLike)、异步生成器和FormData按块流式发送
+            files: multipart上传的文件, 同async_request
         Returns:
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
         return await self._request("PATCH", url, params=params, data=data, json=json, headers=headers, timeout=timeout,
-                                   verify_ssl=verify_ssl, **kwargs)
+                                   verify_ssl=verify_ssl, files=files, **kwargs)
 
-    async def async_delete(self, url, *, params: Dict = None, data: Dict = None, json: Dict = None,
-                           headers: Dict = None, verify_ssl: bool = None, timeout: int = None,
+    async def async_delete(self, url, *, params: Dict = None, data: DataType = None, json: Dict = None,
+                           headers: Dict = None, verify_ssl: bool = None, timeout: TimeoutType = None,
                            **kwargs) -> AsyncResponse:
         """
 
@@ -366,6 +1428,5 @@ class AIOHttpClient(Singleton):
 
         """
         verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
-        timeout = self.timeout if timeout is None else timeout
         return await self._request("DELETE", url, params=params, data=data, json=json, headers=headers,
                                    timeout=timeout, verify_ssl=verify_ssl, **kwargs)
@@ -6,11 +6,14 @@
 @software: PyCharm
 @time: 18-12-25 下午5:15
 """
+import asyncio
 import atexit
 import secrets
+import time
 import uuid
-from collections import MutableMapping
-from typing import Any, Dict, List, NoReturn, Union
+from collections import MutableMapping, OrderedDict
+from contextlib import suppress
+from typing import Any, AsyncIterator, Dict, List, NoReturn, Optional, Tuple, Union
 
 import aelog
 import aredis
@@ -20,11 +23,53 @@ from aredis import RedisError
 from .exceptions import RedisClientError
 from .utils import async_ignore_error
 
-__all__ = ("Session", "AIORedisClient")
+__all__ = ("Session", "NearCache", "AIORedisClient")
 
 LONG_EXPIRED: int = 24 * 60 * 60  # 最长过期时间
 EXPIRED: int = 12 * 60 * 60  # 通用过期时间
 SESSION_EXPIRED: int = 60 * 60  # session过期时间
+INVALIDATION_POLL_INTERVAL: float = 1  # 等待失效通知的超时, 单位秒, 也是停止订阅最长的等待时间
+
+# 读取key并且在剩余的过期时间小于阈值时刷新过期时间, 阈值小于0时总是刷新, 没有过期时间的key也会设置过期时间
+# KEYS[1]: key, ARGV[1]: 过期时间, ARGV[2]: 刷新的阈值, ARGV[3]: 读取的命令, ARGV[4:]: 读取命令的参数
+READ_REFRESH_SCRIPT: str = """
+local data = redis.call(ARGV[3], KEYS[1], unpack(ARGV, 4))
+local ttl = redis.call('TTL', KEYS[1])
+local threshold = tonumber(ARGV[2])
+if ttl == -1 or (ttl >= 0 and (threshold < 0 or ttl < threshold)) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return data
+"""
+
+# session中保存的和账户相关的缓存key的字段
+SESSION_RELATED_FIELDS = ("org_id", "role_id", "permission_id", "static_permission_id", "dynamic_permission_id",
+                          "page_id", "page_menu_id")
+
+# 校验session_id, 用UNLINK删除session以及和账户相关的缓存key, 开启了进程内缓存时为每个删除的key发送失效通知
+# 相关的key是从session中读取的, 没有在KEYS中声明, 不适用于redis集群
+# KEYS[1]: session key, ARGV[1]: session_id, ARGV[2]: 失效通知的频道, 为空时不通知, ARGV[3]: 失效通知的前缀,
+# ARGV[4:]: 相关key的字段
+# 返回-1表示session_id无效, 否则返回{删除的key数, 删除的key名称...}
+DELETE_SESSION_SCRIPT: str = """
+if redis.call('HGET', KEYS[1], 'session_id') ~= ARGV[1] then
+    return -1
+end
+local keys = {}
+for _, key in ipairs(redis.call('HMGET', KEYS[1], unpack(ARGV, 4))) do
+    if key then
+        table.insert(keys, key)
+    end
+end
+table.insert(keys, KEYS[1])
+local deleted = redis.call('UNLINK', unpack(keys))
+if ARGV[2] ~= '' then
+    for _, key in ipairs(keys) do
+        redis.call('PUBLISH', ARGV[2], ARGV[3] .. key)
+    end
+end
+return {deleted, unpack(keys)}
+"""
 
 
 class Session(object):
@@ -49,13 +94,104 @@ class Session(object):
             setattr(self, k, v)
 
 
+class NearCache(object):
+    """
+    进程内的LRU缓存, 每个值在ttl秒后过期, 多个进程之间通过redis的pub/sub通知失效
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 5, channel: str = "aclients:near_cache:invalidate"):
+        """
+        进程内的LRU缓存
+        Args:
+            max_entries: 最多缓存的key数
+            ttl: 缓存的有效时间, 单位秒
+            channel: 通知失效的pub/sub频道
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.channel = channel
+        # 每次失效时加一, 读取redis期间发生了失效的结果不缓存
+        self.generation = 0
+        self._entries = OrderedDict()
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str) -> Any:
+        """
+        获取缓存的值, 没有或者已经过期时返回None
+        Args:
+            name: redis key的名称
+        Returns:
+
+        """
+        entry = self._entries.get(name)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[name]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, name: str, value: Any, generation: int):
+        """
+        缓存值, 从读取redis开始到现在发生过失效时不缓存
+        Args:
+            name: redis key的名称
+            value: 缓存的值
+            generation: 开始读取redis时的generation
+        Returns:
+
+        """
+        if value is None or generation != self.generation:
+            return
+        self._entries[name] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(name)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, name: str):
+        """
+        删除缓存的值
+        Args:
+            name: redis key的名称
+        Returns:
+
+        """
+        self.generation += 1
+        self._entries.pop(name, None)
+
+    def clear(self, ):
+        """
+        清空缓存
+        Args:
+
+        Returns:
+
+        """
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计
+        Args:
+
+        Returns:
+
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
 class AIORedisClient(object):
     """
     redis 非阻塞工具类
     """
 
     def __init__(self, app=None, *, host: str = "127.0.0.1", port: int = 6379, dbname: int = 0, passwd: str = "",
-                 pool_size: int = 50):
+                 pool_size: int = 50, refresh_ratio: float = 1.0, near_cache: Union[bool, Dict] = None):
         """
         redis 非阻塞工具类
         Args:
@@ -65,6 +201,9 @@ class AIORedisClient(object):
             dbname: database name
             passwd: redis password
             pool_size: redis pool size
+            refresh_ratio: 读取时剩余的过期时间小于ex * refresh_ratio才刷新过期时间, 默认1.0每次读取都刷新
+            near_cache: get_session和get_usual_data的进程内缓存, True使用默认配置, 字典为NearCache的参数,
+                        默认None不缓存
         """
         self.app = app
         self.pool = None
@@ -74,14 +213,22 @@ class AIORedisClient(object):
         self.dbname = dbname
         self.passwd = passwd
         self.pool_size = pool_size
+        self.refresh_ratio = refresh_ratio
         self._account_key = "account_to_session"
+        self._read_refresh_script = None
+        self._delete_session_script = None
+        self.near_cache: Optional[NearCache] = self._create_near_cache(near_cache)
+        self._invalidation_task: Optional[asyncio.Task] = None
+        self._invalidation_stopped = False
+        # 区分失效通知是否是当前实例发出的
+        self._near_cache_id = uuid.uuid4().hex
 
         if app is not None:
             self.init_app(app, host=self.host, port=self.port, dbname=self.dbname, passwd=self.passwd,
-                          pool_size=self.pool_size)
+                          pool_size=self.pool_size, refresh_ratio=self.refresh_ratio, near_cache=self.near_cache)
 
     def init_app(self, app, *, host: str = None, port: int = None, dbname: int = None, passwd: str = "",
-                 pool_size: int = None):
+                 pool_size: int = None, refresh_ratio: float = None, near_cache: Union[bool, Dict] = None):
         """
         redis 非阻塞工具类
         Args:
@@ -91,6 +238,8 @@ class AIORedisClient(object):
             dbname: database name
             passwd: redis password
             pool_size: redis pool size
+            refresh_ratio: 读取时剩余的过期时间小于ex * refresh_ratio才刷新过期时间
+            near_cache: get_session和get_usual_data的进程内缓存
         Returns:
 
         """
@@ -100,6 +249,9 @@ class AIORedisClient(object):
         dbname = dbname or app.config.get("ACLIENTS_REDIS_DBNAME", None) or self.dbname
         passwd = passwd or app.config.get("ACLIENTS_REDIS_PASSWD", None) or self.passwd
         pool_size = pool_size or app.config.get("ACLIENTS_REDIS_POOL_SIZE", None) or self.pool_size
+        self.refresh_ratio = refresh_ratio or app.config.get("ACLIENTS_REDIS_REFRESH_RATIO", None) or self.refresh_ratio
+        self.near_cache = self._create_near_cache(near_cache or app.config.get(
+            "ACLIENTS_REDIS_NEAR_CACHE", None)) or self.near_cache
 
         passwd = passwd if passwd is None else str(passwd)
 
@@ -116,6 +268,10 @@ class AIORedisClient(object):
             self.pool = aredis.ConnectionPool(host=host, port=port, db=dbname, password=passwd, decode_responses=True,
                                               max_connections=pool_size)
             self.redis_db = aredis.StrictRedis(connection_pool=self.pool, decode_responses=True)
+            self._register_scripts()
+            if self.near_cache is not None:
+                self._invalidation_stopped = False
+                self._invalidation_task = asyncio.ensure_future(self._subscribe_invalidation())
 
         @app.listener('after_server_stop')
         async def close_connection(app_, loop):
@@ -126,12 +282,13 @@ class AIORedisClient(object):
             Returns:
 
             """
+            await self._stop_invalidation()
             self.redis_db = None
             if self.pool:
                 self.pool.disconnect()
 
     def init_engine(self, *, host: str = None, port: int = None, dbname: int = None, passwd: str = "",
-                    pool_size: int = None):
+                    pool_size: int = None, refresh_ratio: float = None, near_cache: Union[bool, Dict] = None):
         """
         redis 非阻塞工具类
         Args:
@@ -140,6 +297,8 @@ class AIORedisClient(object):
             dbname: database name
             passwd: redis password
             pool_size: redis pool size
+            refresh_ratio: 读取时剩余的过期时间小于ex * refresh_ratio才刷新过期时间
+            near_cache: get_session和get_usual_data的进程内缓存
         Returns:
 
         """
@@ -148,12 +307,19 @@ class AIORedisClient(object):
         dbname = dbname or self.dbname
         passwd = passwd or self.passwd
         pool_size = pool_size or self.pool_size
+        self.refresh_ratio = refresh_ratio or self.refresh_ratio
+        self.near_cache = self._create_near_cache(near_cache) or self.near_cache
 
         passwd = passwd if passwd is None else str(passwd)
         # 返回值都做了解码，应用层不需要再decode
         self.pool = aredis.ConnectionPool(host=host, port=port, db=dbname, password=passwd, decode_responses=True,
                                           max_connections=pool_size)
         self.redis_db = aredis.StrictRedis(connection_pool=self.pool, decode_responses=True)
+        self._register_scripts()
+        loop = asyncio.get_event_loop()
+        if self.near_cache is not None:
+            self._invalidation_stopped = False
+            self._invalidation_task = asyncio.ensure_future(self._subscribe_invalidation())
 
         @atexit.register
         def close_connection():
@@ -164,10 +330,136 @@ class AIORedisClient(object):
             Returns:
 
             """
+            self._invalidation_stopped = True
+            # 事件循环已经关闭时订阅的任务也不会再运行
+            if self._invalidation_task is not None and not (loop.is_closed() or loop.is_running()):
+                loop.run_until_complete(self._stop_invalidation())
             self.redis_db = None
             if self.pool:
                 self.pool.disconnect()
 
+    @staticmethod
+    def _create_near_cache(near_cache: Union[bool, Dict, NearCache, None]) -> Optional[NearCache]:
+        """
+        根据配置创建进程内缓存
+        Args:
+            near_cache: True使用默认配置, 字典为NearCache的参数, 也可以直接是NearCache实例
+        Returns:
+
+        """
+        if not near_cache or isinstance(near_cache, NearCache):
+            return near_cache or None
+        return NearCache(**near_cache) if isinstance(near_cache, MutableMapping) else NearCache()
+
+    async def _subscribe_invalidation(self, ):
+        """
+        订阅失效通知, 删除其他进程修改过的key的缓存, 连接断开后重新订阅
+        Args:
+
+        Returns:
+
+        """
+        # aredis在等待回复时会吞掉CancelledError, 停止时设置停止标志, 等待消息在单独的任务中进行
+        while not self._invalidation_stopped:
+            pubsub = self.redis_db.pubsub(ignore_subscribe_messages=True)
+            read_task = None
+            try:
+                await pubsub.subscribe(self.near_cache.channel)
+                # 连接断开后aredis会自动重连并重新订阅, 不会抛出异常, 断开期间可能错过了失效通知
+                pubsub.connection.register_connect_callback(lambda connection: self.near_cache.clear())
+                # 重新订阅之前可能错过了失效通知
+                self.near_cache.clear()
+                while not self._invalidation_stopped:
+                    # shield保证取消当前任务时一定会抛出CancelledError
+                    read_task = asyncio.ensure_future(pubsub.get_message(timeout=INVALIDATION_POLL_INTERVAL))
+                    message = await asyncio.shield(read_task)
+                    if message and message["type"] == "message":
+                        sender_id, _, name = message["data"].partition(":")
+                        if sender_id != self._near_cache_id:  # 自己发出的通知在发送时已经删除了缓存
+                            self.near_cache.invalidate(name)
+            except RedisError as e:
+                aelog.error("near cache invalidation subscriber error: {}".format(e))
+                await asyncio.sleep(1)
+            finally:
+                # 读取结束后才能关闭连接, 否则aredis会在已经放回连接池的连接上重连
+                if read_task is not None and not read_task.done():
+                    read_task.cancel()
+                    with suppress(Exception):
+                        await read_task
+                pubsub.close()
+
+    async def _stop_invalidation(self, ):
+        """
+        停止订阅失效通知并且等待订阅的任务结束
+        Args:
+
+        Returns:
+
+        """
+        self._invalidation_stopped = True
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._invalidation_task
+            self._invalidation_task = None
+
+    async def _invalidate_near_cache(self, *names: str):
+        """
+        删除本进程的缓存并且通知其他进程, 调用时写入已经成功, 通知失败只记录日志
+        Args:
+            names: redis key的名称
+        Returns:
+
+        """
+        if self.near_cache is None or not names:
+            return
+        for name in names:
+            self.near_cache.invalidate(name)
+        try:
+            async with await self.redis_db.pipeline(transaction=False) as pipe:
+                for name in names:
+                    await pipe.publish(self.near_cache.channel, "{}:{}".format(self._near_cache_id, name))
+                await pipe.execute()
+        except RedisError as e:
+            aelog.error("publish near cache invalidation failed: {}, names={}".format(e, names))
+
+    async def _unlink_keys(self, names: List[str]) -> int:
+        """
+        用UNLINK删除一批key并且删除它们的进程内缓存
+        Args:
+            names: redis key的名称
+        Returns:
+            删除的key数
+        """
+        deleted = await self.redis_db.unlink(*names)
+        await self._invalidate_near_cache(*names)
+        return deleted
+
+    def _register_scripts(self, ):
+        """
+        注册lua脚本, 执行时使用EVALSHA, 服务端没有脚本时aredis会重新加载
+        Args:
+
+        Returns:
+
+        """
+        self._read_refresh_script = self.redis_db.register_script(READ_REFRESH_SCRIPT)
+        self._delete_session_script = self.redis_db.register_script(DELETE_SESSION_SCRIPT)
+
+    async def _read_and_refresh(self, name: str, ex: int, command: str, *args) -> Any:
+        """
+        一次请求中读取key并且按照refresh_ratio刷新过期时间
+        Args:
+            name: redis key的名称
+            ex: 过期时间，单位秒
+            command: 读取的命令, 如HGETALL、GET
+            args: 读取命令的参数
+        Returns:
+            读取命令的返回值
+        """
+        threshold = int(ex * self.refresh_ratio) if self.refresh_ratio < 1 else -1
+        return await self._read_refresh_script.execute(keys=[name], args=[ex, threshold, command, *args])
+
     async def save_session(self, session: Session, dump_responses: bool = False, ex: int = SESSION_EXPIRED) -> str:
         """
         利用hash map保存session
@@ -181,14 +473,21 @@ class AIORedisClient(object):
         session_data = await self.response_dumps(dump_responses, session)
 
         try:
-            if not await self.redis_db.hmset(session_data["session_id"], session_data):
+            # 保存和设置过期时间在一个事务中一次发送, 不会出现没有过期时间的key
+            async with await self.redis_db.pipeline(transaction=True) as pipe:
+                await pipe.hmset(session_data["session_id"], session_data)
+                await pipe.expire(session_data["session_id"], ex)
+                save_result, expire_result = await pipe.execute()
+            if not save_result:
                 raise RedisClientError("save session failed, session_id={}".format(session_data["session_id"]))
-            if not await self.redis_db.expire(session_data["session_id"], ex):
+            if not expire_result:
                 aelog.error("set session expire failed, session_id={}".format(session_data["session_id"]))
         except RedisError as e:
             aelog.exception("save session error: {}, {}".format(session.session_id, e))
             raise RedisClientError(str(e))
         else:
+            # 使用已有的session_id保存时其他进程可能缓存了老的session
+            await self._invalidate_near_cache(session_data["session_id"])
             # 清除老的令牌
             # try:
             #     old_session_id = await self.get_hash_data(self._account_key, field_name=session.account_id)
@@ -218,35 +517,29 @@ class AIORedisClient(object):
 
     async def delete_session(self, session_id: str, delete_key: bool = True) -> NoReturn:
         """
-        利用hash map删除session
+        利用hash map删除session, 校验、读取相关的key和删除在一个lua脚本中一次完成
         Args:
             session_id: session id
             delete_key: 删除account到session的account key
         Returns:
 
         """
-
+        if self.near_cache is not None:
+            channel, prefix = self.near_cache.channel, "{}:".format(self._near_cache_id)
+        else:
+            channel, prefix = "", ""
         try:
-            session_id_ = await self.redis_db.hget(session_id, "session_id")
-            if session_id_ != session_id:
+            result = await self._delete_session_script.execute(
+                keys=[session_id], args=[session_id, channel, prefix, *SESSION_RELATED_FIELDS])
+            if result == -1:
                 raise RedisClientError("invalid session_id, session_id={}".format(session_id))
-            exist_keys = []
-            session_data = await self.get_session(session_id, cls_flag=False)
-            exist_keys.append(session_data["org_id"])
-            exist_keys.append(session_data["role_id"])
-            exist_keys.append(session_data["permission_id"])
-            exist_keys.append(session_data["static_permission_id"])
-            exist_keys.append(session_data["dynamic_permission_id"])
-            exist_keys.append(session_data["page_id"])
-            exist_keys.append(session_data["page_menu_id"])
-
-            async with async_ignore_error():  # 删除已经存在的和账户相关的缓存key
-                await self.delete_keys(exist_keys)
-                # if delete_key is True:
-                #     await self.redis_db.hdel(self._account_key, session_data["account_id"])
-
-            if not await self.redis_db.delete(session_id):
+            deleted, names = result[0], result[1:]
+            if not deleted:
                 aelog.error("delete session failed, session_id={}".format(session_id))
+            # 其他进程的缓存已经在脚本中通知失效
+            if self.near_cache is not None:
+                for name in names:
+                    self.near_cache.invalidate(name)
         except RedisError as e:
             aelog.exception("delete session error: {}, {}".format(session_id, e))
             raise RedisClientError(str(e))
@@ -265,9 +558,18 @@ class AIORedisClient(object):
         session_data = await self.response_dumps(dump_responses, session)
 
         try:
-            if not await self.redis_db.hmset(session_data["session_id"], session_data):
+            async with await self.redis_db.pipeline(transaction=True) as pipe:
+                await pipe.hmset(session_data["session_id"], session_data)
+                await pipe.expire(session_data["session_id"], ex)
+                if self.near_cache is not None:  # 失效通知和更新在同一个事务中发送
+                    await pipe.publish(self.near_cache.channel, "{}:{}".format(
+                        self._near_cache_id, session_data["session_id"]))
+                update_result, expire_result = (await pipe.execute())[:2]
+            if self.near_cache is not None:
+                self.near_cache.invalidate(session_data["session_id"])
+            if not update_result:
                 raise RedisClientError("update session failed, session_id={}".format(session_data["session_id"]))
-            if not await self.redis_db.expire(session_data["session_id"], ex):
+            if not expire_result:
                 aelog.error("set session expire failed, session_id={}".format(session_data["session_id"]))
         except RedisError as e:
             aelog.exception("update session error: {}, {}".format(session_data["session_id"], e))
@@ -290,13 +592,20 @@ class AIORedisClient(object):
 
         """
 
+        cached_data = self.near_cache.get(session_id) if self.near_cache is not None else None
         try:
-            session_data = await self.redis_db.hgetall(session_id)
-            if not session_data:
-                raise RedisClientError("not found session, session_id={}".format(session_id))
-
-            if not await self.redis_db.expire(session_id, ex):
-                aelog.error("set session expire failed, session_id={}".format(session_id))
+            if cached_data is not None:
+                # 缓存的是原始的数据, 需要复制后再使用
+                session_data = dict(cached_data)
+            else:
+                generation = self.near_cache.generation if self.near_cache is not None else 0
+                # 读取和刷新过期时间一次请求完成, lua中HGETALL返回的是键值交替的列表
+                session_data = await self._read_and_refresh(session_id, ex, "HGETALL")
+                if not session_data:
+                    raise RedisClientError("not found session, session_id={}".format(session_id))
+                session_data = dict(zip(session_data[::2], session_data[1::2]))
+                if self.near_cache is not None:
+                    self.near_cache.set(session_id, dict(session_data), generation)
         except RedisError as e:
             aelog.exception("get session error: {}, {}".format(session_id, e))
             raise RedisClientError(e)
@@ -351,28 +660,33 @@ class AIORedisClient(object):
             raise ValueError("hash data error, must be MutableMapping.")
 
         try:
-            if not field_name:
-                # 是否对每个键值进行dump
-                if dump_responses:
-                    rs_data = {}
-                    for hash_key, hash_val in hash_data.items():
-                        if not isinstance(hash_val, str):
-                            async with async_ignore_error():
-                                hash_val = ujson.dumps(hash_val)
-                        rs_data[hash_key] = hash_val
-                    hash_data = rs_data
-
-                if not await self.redis_db.hmset(name, hash_data):
-                    raise RedisClientError("save hash data mapping failed, session_id={}".format(name))
-            else:
-                hash_data = hash_data if isinstance(hash_data, str) else ujson.dumps(hash_data)
-                await self.redis_db.hset(name, field_name, hash_data)
-
-            if not await self.redis_db.expire(name, ex):
+            async with await self.redis_db.pipeline(transaction=True) as pipe:
+                if not field_name:
+                    # 是否对每个键值进行dump
+                    if dump_responses:
+                        rs_data = {}
+                        for hash_key, hash_val in hash_data.items():
+                            if not isinstance(hash_val, str):
+                                async with async_ignore_error():
+                                    hash_val = ujson.dumps(hash_val)
+                            rs_data[hash_key] = hash_val
+                        hash_data = rs_data
+                    await pipe.hmset(name, hash_data)
+                else:
+                    hash_data = hash_data if isinstance(hash_data, str) else ujson.dumps(hash_data)
+                    await pipe.hset(name, field_name, hash_data)
+                await pipe.expire(name, ex)
+                save_result, expire_result = await pipe.execute()
+
+            if not field_name and not save_result:
+                raise RedisClientError("save hash data mapping failed, session_id={}".format(name))
+            if not expire_result:
                 aelog.error("set hash data expire failed, session_id={}".format(name))
         except RedisError as e:
             raise RedisClientError(str(e))
         else:
+            # hash对象可能是get_session缓存的session
+            await self._invalidate_near_cache(name)
             return name
 
     async def get_hash_data(self, name: str, field_name: str = None, ex: int = EXPIRED,
@@ -389,13 +703,14 @@ class AIORedisClient(object):
         """
         try:
             if field_name:
-                hash_data = await self.redis_db.hget(name, field_name)
+                hash_data = await self._read_and_refresh(name, ex, "HGET", field_name)
                 # 返回的键值对是否做load
                 if load_responses:
                     async with async_ignore_error():
                         hash_data = ujson.loads(hash_data)
             else:
-                hash_data = await self.redis_db.hgetall(name)
+                hash_data = await self._read_and_refresh(name, ex, "HGETALL")
+                hash_data = dict(zip(hash_data[::2], hash_data[1::2]))
                 # 返回的键值对是否做load
                 if load_responses:
                     rs_data = {}
@@ -406,9 +721,6 @@ class AIORedisClient(object):
                     hash_data = rs_data
             if not hash_data:
                 raise RedisClientError("not found hash data, name={}, field_name={}".format(name, field_name))
-
-            if not await self.redis_db.expire(name, ex):
-                aelog.error("set expire failed, name={}".format(name))
         except RedisError as e:
             raise RedisClientError(str(e))
         else:
@@ -426,9 +738,7 @@ class AIORedisClient(object):
 
         """
         try:
-            data = await self.redis_db.lrange(name, start=start, end=end)
-            if not await self.redis_db.expire(name, ex):
-                aelog.error("set expire failed, name={}".format(name))
+            data = await self._read_and_refresh(name, ex, "LRANGE", start, end)
         except RedisError as e:
             raise RedisClientError(str(e))
         else:
@@ -448,13 +758,16 @@ class AIORedisClient(object):
         """
         list_data = (list_data,) if isinstance(list_data, str) else list_data
         try:
-            if save_to_left:
-                if not await self.redis_db.lpush(name, *list_data):
-                    raise RedisClientError("lpush value to head failed.")
-            else:
-                if not await self.redis_db.rpush(name, *list_data):
-                    raise RedisClientError("lpush value to tail failed.")
-            if not await self.redis_db.expire(name, ex):
+            async with await self.redis_db.pipeline(transaction=True) as pipe:
+                if save_to_left:
+                    await pipe.lpush(name, *list_data)
+                else:
+                    await pipe.rpush(name, *list_data)
+                await pipe.expire(name, ex)
+                push_result, expire_result = await pipe.execute()
+            if not push_result:
+                raise RedisClientError("lpush value to head failed." if save_to_left else "lpush value to tail failed.")
+            if not expire_result:
                 aelog.error("set expire failed, name={}".format(name))
         except RedisError as e:
             raise RedisClientError(str(e))
@@ -478,6 +791,7 @@ class AIORedisClient(object):
         except RedisError as e:
             raise RedisClientError(str(e))
         else:
+            await self._invalidate_near_cache(name)
             return name
 
     async def incrbynumber(self, name: str, amount: int = 1, ex: int = EXPIRED) -> str:
@@ -489,17 +803,22 @@ class AIORedisClient(object):
 
         """
         try:
-            if isinstance(amount, int):
-                if not await self.redis_db.incr(name, amount):
-                    raise RedisClientError("Increments int value failed!")
-            else:
-                if not await self.redis_db.incrbyfloat(name, amount):
-                    raise RedisClientError("Increments float value failed!")
-            if not await self.redis_db.expire(name, ex):
+            async with await self.redis_db.pipeline(transaction=True) as pipe:
+                if isinstance(amount, int):
+                    await pipe.incr(name, amount)
+                else:
+                    await pipe.incrbyfloat(name, amount)
+                await pipe.expire(name, ex)
+                incr_result, expire_result = await pipe.execute()
+            if not incr_result:
+                raise RedisClientError("Increments int value failed!" if isinstance(amount, int) else
+                                       "Increments float value failed!")
+            if not expire_result:
                 aelog.error("set expire failed, name={}".format(name))
         except RedisError as e:
             raise RedisClientError(str(e))
         else:
+            await self._invalidate_near_cache(name)
             return name
 
     async def get_usual_data(self, name: str, load_responses: bool = True, update_expire: bool = True,
@@ -514,11 +833,15 @@ class AIORedisClient(object):
         Returns:
             反序列化对象
         """
-        data = await self.redis_db.get(name)
-
-        if data is not None and update_expire:  # 保证key存在时设置过期时间
-            if not await self.redis_db.expire(name, ex):
-                aelog.error("set expire failed, name={}".format(name))
+        data = self.near_cache.get(name) if self.near_cache is not None else None
+        if data is None:
+            generation = self.near_cache.generation if self.near_cache is not None else 0
+            if update_expire:  # key存在时才会设置过期时间
+                data = await self._read_and_refresh(name, ex, "GET")
+            else:
+                data = await self.redis_db.get(name)
+            if self.near_cache is not None:
+                self.near_cache.set(name, data, generation)
 
         if load_responses:
             async with async_ignore_error():
@@ -547,13 +870,99 @@ class AIORedisClient(object):
         names = (names,) if isinstance(names, str) else names
         if not await self.redis_db.delete(*names):
             aelog.error("Delete redis keys failed {}.".format(*names))
+        await self._invalidate_near_cache(*names)
 
     async def get_keys(self, pattern_name: str) -> List:
         """
-        根据正则表达式获取redis的keys
+        根据正则表达式获取redis的keys, 使用SCAN分批获取, 不会阻塞redis服务端
         Args:
             pattern_name:正则表达式的名称
         Returns:
 
         """
-        return await self.redis_db.keys(pattern_name)
+        # SCAN可能返回重复的key
+        return list(dict.fromkeys([key async for key in self.scan_keys(pattern_name)]))
+
+    async def scan_keys(self, pattern_name: str = None, count: int = 1000) -> AsyncIterator[str]:
+        """
+        使用SCAN迭代匹配的redis keys, 每次只从服务端获取一批, 迭代过程中修改的key可能重复或者遗漏
+
+        async for key in redis_client.scan_keys("session:*"):
+            ...
+        Args:
+            pattern_name: 匹配的模式, 默认所有的key
+            count: 每次SCAN的数量提示
+        Returns:
+
+        """
+        try:
+            async for key in self.redis_db.scan_iter(match=pattern_name, count=count):
+                yield key
+        except RedisError as e:
+            raise RedisClientError(str(e))
+
+    async def hscan_data(self, name: str, pattern_name: str = None,
+                         count: int = 1000) -> AsyncIterator[Tuple[str, str]]:
+        """
+        使用HSCAN迭代hash对象中匹配的字段和值
+        Args:
+            name: redis hash key的名称
+            pattern_name: 字段匹配的模式, 默认所有的字段
+            count: 每次HSCAN的数量提示
+        Returns:
+            (字段, 值)
+        """
+        try:
+            async for field_name, value in self.redis_db.hscan_iter(name, match=pattern_name, count=count):
+                yield field_name, value
+        except RedisError as e:
+            raise RedisClientError(str(e))
+
+    async def sscan_data(self, name: str, pattern_name: str = None, count: int = 1000) -> AsyncIterator[str]:
+        """
+        使用SSCAN迭代集合中匹配的成员
+        Args:
+            name: redis set key的名称
+            pattern_name: 成员匹配的模式, 默认所有的成员
+            count: 每次SSCAN的数量提示
+        Returns:
+
+        """
+        try:
+            async for member in self.redis_db.sscan_iter(name, match=pattern_name, count=count):
+                yield member
+        except RedisError as e:
+            raise RedisClientError(str(e))
+
+    async def delete_by_pattern(self, pattern_name: str, count: int = 1000, chunk_size: int = 500) -> int:
+        """
+        删除所有匹配的redis keys, SCAN分批获取key, 每chunk_size个key用一个UNLINK删除, 服务端在后台释放内存
+        Args:
+            pattern_name: 匹配的模式
+            count: 每次SCAN的数量提示
+            chunk_size: 每次UNLINK的key数
+        Returns:
+            删除的key数
+        """
+        deleted, chunk, unlink_task = 0, [], None
+        try:
+            async for key in self.scan_keys(pattern_name, count=count):
+                chunk.append(key)
+                if len(chunk) >= chunk_size:
+                    # 删除上一批的同时继续扫描下一批
+                    if unlink_task is not None:
+                        deleted += await unlink_task
+                    unlink_task = asyncio.ensure_future(self._unlink_keys(chunk))
+                    chunk = []
+            if unlink_task is not None:
+                deleted += await unlink_task
+                unlink_task = None
+            if chunk:
+                deleted += await self._unlink_keys(chunk)
+        except RedisError as e:
+            raise RedisClientError(str(e))
+        finally:
+            if unlink_task is not None:
+                unlink_task.cancel()
+        return deleted
+
@@ -8,10 +8,10 @@
 """
 from sanic.exceptions import SanicException
 
-__all__ = ("ClientError", "ClientResponseError", "ClientConnectionError", "HttpError", "RedisClientError",
-           "RedisConnectError", "MysqlDuplicateKeyError", "MysqlError", "MysqlInvalidNameError", "FuncArgsError",
-           "Error", "PermissionDeniedError", "QueryArgsError", "MongoError", "MongoDuplicateKeyError",
-           "MongoInvalidNameError", "CommandArgsError", "EmailError", "ConfigError")
+__all__ = ("ClientError", "ClientResponseError", "ClientConnectionError", "CircuitOpenError", "RateLimitError",
+           "JsonRPCError", "HttpError", "RedisClientError", "RedisConnectError", "MysqlDuplicateKeyError", "MysqlError",
+           "MysqlInvalidNameError", "FuncArgsError", "Error", "PermissionDeniedError", "QueryArgsError", "MongoError",
+           "MongoDuplicateKeyError", "MongoInvalidNameError", "CommandArgsError", "EmailError", "ConfigError")
 
 
 class Error(Exception):
@@ -73,6 +73,35 @@ class ClientConnectionError(ClientError):
     pass
 
 
+class CircuitOpenError(ClientConnectionError):
+    """熔断器打开时快速失败的异常"""
+
+    pass
+
+
+class RateLimitError(ClientError):
+    """客户端限流等待超时的异常"""
+
+    pass
+
+
+class JsonRPCError(ClientError):
+    """
+    JSON-RPC调用返回的错误
+    """
+
+    def __init__(self, url, *, code=None, message=None, data=None):
+        self.code = code
+        self.data = data
+        super().__init__(url, message=message)
+
+    def __str__(self):
+        return "Error: code={}, url='{}', message='{}', data='{}'".format(self.code, self.url, self.message, self.data)
+
+    def __repr__(self):
+        return "<{} '{}, {}, {}'>".format(self.__class__.__name__, self.code, self.url, self.message)
+
+
 class HttpError(Error, SanicException):
     """
     主要处理http 错误,从接口返回
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午2:05
+
+AIOHttpClient的响应缓存
+"""
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+from multidict import CIMultiDict, MultiDict
+from yarl import URL
+
+__all__ = ("HttpCache", "CacheEntry")
+
+
+class CacheEntry(object):
+    """
+    缓存的响应
+    """
+    __slots__ = ["response", "expires", "etag", "last_modified", "size"]
+
+    def __init__(self, response, expires: float, etag: Optional[str], last_modified: Optional[str]):
+        """
+        缓存的响应
+        Args:
+            response: 缓存的AsyncResponse
+            expires: 过期的时间点, time.monotonic()
+            etag: 响应的ETag
+            last_modified: 响应的Last-Modified
+        """
+        self.response = response
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = len(response.content)
+
+    @property
+    def is_fresh(self, ) -> bool:
+        """
+        是否还在有效期内
+        Args:
+
+        Returns:
+
+        """
+        return time.monotonic() < self.expires
+
+    def validators(self, ) -> Dict[str, str]:
+        """
+        重新验证时使用的请求头
+        Args:
+
+        Returns:
+
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache(object):
+    """
+    遵循Cache-Control和ETag/Last-Modified的GET响应缓存, 按照条目数和字节数限制大小, LRU淘汰
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        """
+        响应缓存
+        Args:
+            max_entries: 最多缓存的响应数
+            max_bytes: 最多缓存的响应体字节数
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(url: str, params: Any = None, headers: Any = None) -> Optional[Tuple]:
+        """
+        缓存的键, 请求头不同的请求分别缓存, params和headers可以是aiohttp支持的任何形式, 如字典、键值对列表、查询字符串
+        Args:
+            url: 请求的url
+            params: 请求参数
+            headers: 请求头
+        Returns:
+            无法构造时返回None, 这时请求不使用缓存
+        """
+        try:
+            request_url = URL(url)
+            if params:
+                # 和aiohttp一样, params追加在url中已有的查询参数之后
+                query = MultiDict(request_url.query)
+                query.extend(request_url.with_query(params).query)
+                request_url = request_url.with_query(query)
+            headers = CIMultiDict(headers or {})
+        except (TypeError, ValueError):
+            return None
+        # 按照名称排序, 同名参数保持原来的顺序
+        query = tuple(sorted(request_url.query.items(), key=lambda item: item[0]))
+        headers = tuple(sorted(((key.lower(), str(val)) for key, val in headers.items()), key=lambda item: item[0]))
+        return str(request_url.with_query(None)), query, headers
+
+    @staticmethod
+    def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+        """
+        解析Cache-Control
+        Args:
+            value: Cache-Control的值
+        Returns:
+            {指令: 值}, 没有值的指令值为None
+        """
+        directives = {}
+        for directive in (value or "").split(","):
+            name, _, val = directive.strip().partition("=")
+            if name:
+                directives[name.lower()] = val.strip('" ') or None
+        return directives
+
+    @classmethod
+    def get_ttl(cls, headers) -> Optional[float]:
+        """
+        根据响应头计算响应的有效时间
+        Args:
+            headers: 响应头
+        Returns:
+            有效的秒数, 不允许缓存时返回None
+        """
+        directives = cls.parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in directives:
+            return None
+        if "no-cache" in directives:
+            return 0.0
+        if directives.get("max-age"):
+            try:
+                return max(0.0, float(directives["max-age"]))
+            except ValueError:
+                return 0.0
+        if headers.get("Expires"):
+            try:
+                return max(0.0, parsedate_to_datetime(headers["Expires"]).timestamp() - time.time())
+            except (TypeError, ValueError, IndexError):
+                return 0.0
+        return 0.0
+
+    def get(self, key: Tuple) -> Optional[CacheEntry]:
+        """
+        获取缓存的响应
+        Args:
+            key: 缓存的键
+        Returns:
+
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def store(self, key: Tuple, response) -> bool:
+        """
+        缓存响应, 没有有效期并且没有验证器的响应不缓存
+        Args:
+            key: 缓存的键
+            response: AsyncResponse
+        Returns:
+            是否缓存了响应
+        """
+        if response.status_code != 200:
+            return False
+        ttl = self.get_ttl(response.headers)
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if ttl is None or (ttl <= 0 and not etag and not last_modified):
+            return False
+        entry = CacheEntry(response, time.monotonic() + ttl, etag, last_modified)
+        if entry.size > self.max_bytes:
+            return False
+
+        self.remove(key)
+        self._entries[key] = entry
+        self.current_bytes += entry.size
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.size
+            self.evictions += 1
+        return True
+
+    def revalidate(self, key: Tuple, entry: CacheEntry, headers) -> CacheEntry:
+        """
+        304响应后按照新的响应头更新有效期
+        Args:
+            key: 缓存的键
+            entry: 缓存的响应
+            headers: 304响应的响应头
+        Returns:
+
+        """
+        ttl = self.get_ttl(headers)
+        if ttl is None:
+            self.remove(key)
+        else:
+            entry.expires = time.monotonic() + ttl
+            entry.etag = headers.get("ETag") or entry.etag
+            entry.last_modified = headers.get("Last-Modified") or entry.last_modified
+        self.revalidations += 1
+        return entry
+
+    def remove(self, key: Tuple):
+        """
+        删除缓存的响应
+        Args:
+            key: 缓存的键
+        Returns:
+
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def clear(self, ):
+        """
+        清空缓存
+        Args:
+
+        Returns:
+
+        """
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计
+        Args:
+
+        Returns:
+
+        """
+        return {"hits": self.hits, "misses": self.misses, "revalidations": self.revalidations,
+                "evictions": self.evictions, "entries": len(self._entries), "bytes": self.current_bytes}
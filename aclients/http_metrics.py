@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午4:30
+
+基于aiohttp TraceConfig的请求分阶段耗时统计
+"""
+import bisect
+import time
+from typing import Dict, Sequence
+
+import aiohttp
+
+__all__ = ("Histogram", "HttpMetrics")
+
+# 默认的直方图分桶, 单位秒
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """
+    固定分桶的直方图
+    """
+    __slots__ = ["buckets", "counts", "count", "sum", "max"]
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        固定分桶的直方图
+        Args:
+            buckets: 递增的分桶上界, 最后还有一个+Inf的分桶
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """
+        记录一个值
+        Args:
+            value: 耗时, 单位秒
+        Returns:
+
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self, ) -> Dict:
+        """
+        直方图的快照, buckets为每个上界对应的累计数量
+        Args:
+
+        Returns:
+
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+
+class HttpMetrics(object):
+    """
+    按host统计请求各个阶段的耗时
+
+    dns: DNS解析, 只有没有命中DNS缓存时才有
+    pool_wait: 等待连接池的空闲连接, 只有连接数达到上限时才有
+    connect: 建立新连接, 包括TCP和TLS握手, 不包括其中的DNS解析, aiohttp不能单独统计TLS
+    ttfb: 请求头发送完到收到响应头, 需要aiohttp>=3.8
+    request: 请求开始到收到响应头的总耗时
+    """
+    PHASES = ("dns", "pool_wait", "connect", "ttfb", "request")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        请求分阶段耗时统计
+        Args:
+            buckets: 直方图的分桶上界, 单位秒
+        """
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def observe(self, host: str, phase: str, value: float):
+        """
+        记录host的一个阶段的耗时
+        Args:
+            host: 请求的host
+            phase: 阶段的名称
+            value: 耗时, 单位秒
+        Returns:
+
+        """
+        if host not in self._histograms:
+            self._histograms[host] = {name: Histogram(self.buckets) for name in self.PHASES}
+        self._histograms[host][phase].observe(value)
+
+    def incr(self, host: str, counter: str):
+        """
+        host的计数加一
+        Args:
+            host: 请求的host
+            counter: 计数的名称, new_connections, reused_connections, errors
+        Returns:
+
+        """
+        if host not in self._counters:
+            self._counters[host] = {"new_connections": 0, "reused_connections": 0, "errors": 0}
+        self._counters[host][counter] += 1
+
+    def snapshot(self, ) -> Dict[str, Dict]:
+        """
+        所有host的统计快照
+        Args:
+
+        Returns:
+            {host: {"dns": {...}, ..., "new_connections": 0, "reused_connections": 0, "errors": 0}}
+        """
+        result = {}
+        for host in set(self._histograms) | set(self._counters):
+            host_result = {name: histogram.snapshot() for name, histogram in self._histograms.get(host, {}).items()}
+            host_result.update(self._counters.get(host, {}))
+            result[host] = host_result
+        return result
+
+    def reset(self, ):
+        """
+        清空统计
+        Args:
+
+        Returns:
+
+        """
+        self._histograms.clear()
+        self._counters.clear()
+
+    def trace_config(self, ) -> aiohttp.TraceConfig:
+        """
+        创建记录到当前统计的TraceConfig, 需要在创建session时传入
+        Args:
+
+        Returns:
+
+        """
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            # 和urlsplit(url).netloc保持一致, 默认端口时不带端口
+            url = params.url
+            ctx.host = url.raw_host if url.is_default_port() else "{}:{}".format(url.raw_host, url.port)
+            ctx.request_start = time.monotonic()
+            ctx.dns_start = ctx.pool_wait_start = ctx.connect_start = ctx.headers_sent = None
+            ctx.dns_elapsed = 0.0
+
+        # DNS解析在建立连接的过程中进行, 每个阶段使用自己的开始时间
+        async def on_dns_resolvehost_start(session, ctx, params):
+            ctx.dns_start = time.monotonic()
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            elapsed = time.monotonic() - ctx.dns_start
+            ctx.dns_elapsed += elapsed
+            self.observe(ctx.host, "dns", elapsed)
+
+        async def on_connection_queued_start(session, ctx, params):
+            ctx.pool_wait_start = time.monotonic()
+
+        async def on_connection_queued_end(session, ctx, params):
+            self.observe(ctx.host, "pool_wait", time.monotonic() - ctx.pool_wait_start)
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_start = time.monotonic()
+            ctx.dns_elapsed = 0.0
+
+        async def on_connection_create_end(session, ctx, params):
+            # 减去建立连接期间的DNS解析耗时, DNS单独统计
+            self.observe(ctx.host, "connect", time.monotonic() - ctx.connect_start - ctx.dns_elapsed)
+            self.incr(ctx.host, "new_connections")
+
+        async def on_request_headers_sent(session, ctx, params):
+            ctx.headers_sent = time.monotonic()
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.incr(ctx.host, "reused_connections")
+
+        async def on_request_end(session, ctx, params):
+            now = time.monotonic()
+            if ctx.headers_sent is not None:
+                self.observe(ctx.host, "ttfb", now - ctx.headers_sent)
+            self.observe(ctx.host, "request", now - ctx.request_start)
+
+        async def on_request_exception(session, ctx, params):
+            self.incr(ctx.host, "errors")
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        if hasattr(trace_config, "on_request_headers_sent"):  # aiohttp>=3.8
+            trace_config.on_request_headers_sent.append(on_request_headers_sent)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
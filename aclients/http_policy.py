@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 上午10:12
+
+AIOHttpClient使用的请求策略
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional, Union
+
+import aiohttp
+
+from .exceptions import CircuitOpenError, ClientConnectionError, ClientError, ClientResponseError, RateLimitError
+
+__all__ = ("HttpTimeout", "RetryBudget", "RetryPolicy", "CircuitBreaker", "HedgePolicy", "RateLimiter")
+
+
+class HttpTimeout(object):
+    """
+    分阶段的超时时间, 单位秒, None表示不限制
+
+    total: 整个请求的超时, 包括读取响应体
+    pool: 获取连接的超时, 包括等待连接池的空闲连接和建立新连接
+    connect: 建立TCP连接的超时
+    first_byte: 从开始请求到收到响应头的超时
+    read: 读取响应时两次收到数据之间的超时
+    """
+    __slots__ = ["total", "pool", "connect", "first_byte", "read"]
+
+    def __init__(self, total: float = None, *, pool: float = None, connect: float = None, first_byte: float = None,
+                 read: float = None):
+        """
+        分阶段的超时时间
+        Args:
+            total: 整个请求的超时
+            pool: 获取连接的超时
+            connect: 建立TCP连接的超时
+            first_byte: 收到响应头的超时
+            read: 两次收到数据之间的超时
+        """
+        self.total = total
+        self.pool = pool
+        self.connect = connect
+        self.first_byte = first_byte
+        self.read = read
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, ", ".join(
+            "{}={}".format(name, getattr(self, name)) for name in self.__slots__))
+
+    @classmethod
+    def from_value(cls, value: Union["HttpTimeout", Dict, float, None]) -> Optional["HttpTimeout"]:
+        """
+        兼容整数的超时, 整数表示整个请求的超时, 字典为HttpTimeout的参数
+        Args:
+            value: 超时配置
+        Returns:
+
+        """
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        return cls(total=value)
+
+    def merge(self, other: Optional["HttpTimeout"]) -> "HttpTimeout":
+        """
+        用other中不为None的值覆盖当前的值, 返回新的对象
+        Args:
+            other: 优先级更高的超时配置
+        Returns:
+
+        """
+        if other is None:
+            return self
+        return HttpTimeout(**{name: getattr(other, name) if getattr(other, name) is not None else getattr(self, name)
+                              for name in self.__slots__})
+
+    def to_client_timeout(self, ) -> aiohttp.ClientTimeout:
+        """
+        转换为aiohttp的超时, first_byte由调用方单独处理
+        Args:
+
+        Returns:
+
+        """
+        return aiohttp.ClientTimeout(total=self.total, connect=self.pool, sock_connect=self.connect,
+                                     sock_read=self.read)
+
+
+class RetryBudget(object):
+    """
+    令牌桶形式的重试预算
+
+    每个请求存入ratio个令牌, 每次重试消耗一个令牌, 另外每秒补充min_per_second个令牌保证低流量时也可以重试,
+    上游故障时重试的数量最多为请求数量的ratio倍, 防止重试风暴放大上游的负载
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 10, max_tokens: float = 100):
+        """
+        重试预算
+        Args:
+            ratio: 每个请求存入的令牌数, 即允许的重试数和请求数的比例
+            min_per_second: 每秒补充的令牌数
+            max_tokens: 令牌桶的容量
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+
+    def _refill(self, ):
+        """
+        按照时间补充令牌
+        Args:
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self, ):
+        """
+        每个请求存入令牌
+        Args:
+
+        Returns:
+
+        """
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self, ) -> bool:
+        """
+        每次重试消耗一个令牌, 令牌不足时返回False
+        Args:
+
+        Returns:
+
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RetryPolicy(object):
+    """
+    重试策略, 指数退避加随机抖动
+
+    只重试幂等的请求方法, 连接异常(包括超时)和retry_statuses中的响应码会重试,
+    响应中有Retry-After时按照Retry-After的时间等待
+    """
+
+    def __init__(self, max_retries: int = 3, *, backoff_factor: float = 0.1, max_backoff: float = 10,
+                 jitter: bool = True, retry_statuses: Iterable[int] = (429, 502, 503, 504),
+                 retry_methods: Iterable[str] = ("GET", "PUT", "DELETE", "HEAD", "OPTIONS"),
+                 respect_retry_after: bool = True, budget: RetryBudget = None):
+        """
+        重试策略
+        Args:
+            max_retries: 最大的重试次数
+            backoff_factor: 退避的基数, 第n次重试前等待backoff_factor * 2 ** n秒
+            max_backoff: 最长的等待时间, Retry-After超过这个时间时不再重试
+            jitter: 是否在[0, 退避时间]之间随机等待, 避免多个客户端同时重试
+            retry_statuses: 需要重试的响应码
+            retry_methods: 需要重试的请求方法, 默认只重试幂等的方法
+            respect_retry_after: 是否按照响应中的Retry-After等待
+            budget: 重试预算, 默认每个策略一个RetryBudget
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(method.upper() for method in retry_methods)
+        self.respect_retry_after = respect_retry_after
+        self.budget = budget or RetryBudget()
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        解析Retry-After, 可以是秒数也可以是HTTP日期
+        Args:
+            value: Retry-After的值
+        Returns:
+            需要等待的秒数, 无法解析时返回None
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        return max(0.0, retry_date.timestamp() - time.time())
+
+    def get_backoff(self, attempt: int) -> float:
+        """
+        第attempt次重试前的退避时间
+        Args:
+            attempt: 已经重试的次数, 从0开始
+        Returns:
+
+        """
+        backoff = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+    def get_retry_delay(self, method: str, attempt: int, error: ClientError) -> Optional[float]:
+        """
+        判断请求失败后是否需要重试
+        Args:
+            method: 请求方法
+            attempt: 已经重试的次数, 从0开始
+            error: 请求失败的异常
+        Returns:
+            重试前需要等待的秒数, 不需要重试时返回None
+        """
+        if attempt >= self.max_retries or method.upper() not in self.retry_methods:
+            return None
+        if isinstance(error, CircuitOpenError):  # 熔断时重试没有意义
+            return None
+        if isinstance(error, ClientResponseError):
+            if error.status_code not in self.retry_statuses:
+                return None
+        elif not isinstance(error, ClientConnectionError):
+            return None
+
+        delay = self.get_backoff(attempt)
+        if self.respect_retry_after and isinstance(error, ClientResponseError) and error.headers:
+            retry_after = self.parse_retry_after(error.headers.get("Retry-After"))
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    return None
+                delay = retry_after
+        # 预算最后检查, 不重试的时候不消耗令牌
+        if not self.budget.withdraw():
+            return None
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    熔断器
+
+    closed: 正常状态, 统计window秒内的请求, 请求数不少于min_requests并且失败率达到failure_rate时打开
+    open: 打开状态, 所有请求快速失败, cooldown秒后进入half_open
+    half_open: 半开状态, 最多允许half_open_requests个探测请求, 全部成功后关闭, 任何一个失败重新打开
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, *, failure_rate: float = 0.5, window: float = 60, min_requests: int = 20,
+                 cooldown: float = 30, half_open_requests: int = 1):
+        """
+        熔断器
+        Args:
+            failure_rate: 打开熔断器的失败率
+            window: 统计失败率的时间窗口, 单位秒
+            min_requests: 时间窗口内最少的请求数, 请求数不足时不打开熔断器
+            cooldown: 打开后到进入半开状态的时间, 单位秒
+            half_open_requests: 半开状态允许的探测请求数
+        """
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.half_open_requests = half_open_requests
+        self._state = self.CLOSED
+        self._outcomes = deque()  # (时间, 是否失败)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+
+    @property
+    def state(self, ) -> str:
+        """
+        熔断器的状态, 打开超过cooldown后变为半开
+        Args:
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        # 打开超过cooldown进入半开, 半开的探测请求超过cooldown还没有结果(比如被取消)时重新允许探测
+        if ((self._state == self.OPEN and now - self._opened_at >= self.cooldown) or
+                (self._state == self.HALF_OPEN and now - self._half_open_at >= self.cooldown)):
+            self._state = self.HALF_OPEN
+            self._half_open_at = now
+            self._half_open_calls = 0
+            self._half_open_successes = 0
+        return self._state
+
+    def _prune(self, now: float):
+        """
+        删除时间窗口之外的统计
+        Args:
+
+        Returns:
+
+        """
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def _open(self, ):
+        """
+        打开熔断器
+        Args:
+
+        Returns:
+
+        """
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._failures = 0
+
+    def allow_request(self, ) -> bool:
+        """
+        是否允许请求通过
+        Args:
+
+        Returns:
+
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_requests:
+            self._half_open_calls += 1
+            return True
+        return False
+
+    def record(self, failed: bool):
+        """
+        记录请求的结果
+        Args:
+            failed: 请求是否失败
+        Returns:
+
+        """
+        state = self.state
+        if state == self.HALF_OPEN:
+            if failed:
+                self._open()
+            else:
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_requests:
+                    self._state = self.CLOSED
+            return
+        if state == self.OPEN:  # 打开前已经发出的请求
+            return
+
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._prune(now)
+        total = len(self._outcomes)
+        if total >= self.min_requests and self._failures / total >= self.failure_rate:
+            self._open()
+
+    def snapshot(self, ) -> Dict:
+        """
+        熔断器的状态, 用于健康检查
+        Args:
+
+        Returns:
+
+        """
+        self._prune(time.monotonic())
+        total = len(self._outcomes)
+        return {"state": self.state, "requests": total, "failures": self._failures,
+                "failure_rate": self._failures / total if total else 0.0}
+
+
+class HedgePolicy(object):
+    """
+    对冲请求策略
+
+    幂等请求在delay秒内没有响应时再发送一个相同的请求, 使用先完成的响应并取消另一个,
+    没有配置delay时使用每个host最近请求耗时的percentile分位数, 样本不足时不对冲,
+    对冲请求数不超过请求数的max_hedge_ratio倍, 保证额外的负载有上限
+    """
+
+    def __init__(self, *, delay: float = None, percentile: float = 0.95, max_hedge_ratio: float = 0.05,
+                 min_samples: int = 100, window: int = 1000, hedge_methods: Iterable[str] = ("GET", "HEAD")):
+        """
+        对冲请求策略
+        Args:
+            delay: 固定的对冲等待时间, 单位秒, 默认None使用耗时分位数
+            percentile: 耗时分位数, 0到1之间
+            max_hedge_ratio: 对冲请求数和请求数的最大比例
+            min_samples: 使用耗时分位数时每个host最少的样本数
+            window: 每个host保留的最近的耗时样本数
+            hedge_methods: 允许对冲的请求方法, 只能是幂等的方法
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self.hedge_methods = frozenset(method.upper() for method in hedge_methods)
+        self.requests = 0
+        self.hedges = 0
+        self._latencies: Dict[str, deque] = {}
+        self._delays: Dict[str, float] = {}
+
+    def record_latency(self, host: str, latency: float):
+        """
+        记录请求的耗时, 每记录min_samples // 10个样本重新计算一次分位数
+        Args:
+            host: 请求的host
+            latency: 耗时, 单位秒
+        Returns:
+
+        """
+        if host not in self._latencies:
+            self._latencies[host] = deque(maxlen=self.window)
+        latencies = self._latencies[host]
+        latencies.append(latency)
+        if len(latencies) >= self.min_samples and (
+                host not in self._delays or len(latencies) % max(1, self.min_samples // 10) == 0):
+            ordered = sorted(latencies)
+            self._delays[host] = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    def get_delay(self, method: str, host: str) -> Optional[float]:
+        """
+        对冲前等待的时间
+        Args:
+            method: 请求方法
+            host: 请求的host
+        Returns:
+            等待的秒数, 不对冲时返回None
+        """
+        if method.upper() not in self.hedge_methods:
+            return None
+        return self.delay if self.delay is not None else self._delays.get(host)
+
+    def allow_hedge(self, ) -> bool:
+        """
+        是否允许发送对冲请求, 允许时计数
+        Args:
+
+        Returns:
+
+        """
+        if self.hedges < self.requests * self.max_hedge_ratio:
+            self.hedges += 1
+            return True
+        return False
+
+    def stats(self, ) -> Dict:
+        """
+        对冲的统计
+        Args:
+
+        Returns:
+
+        """
+        return {"requests": self.requests, "hedges": self.hedges, "delays": dict(self._delays)}
+
+
+class RateLimiter(object):
+    """
+    令牌桶限流
+
+    每秒产生rate个令牌, 最多积累burst个, 令牌不足时按照请求到达的顺序预约后续的令牌并异步等待,
+    先到的请求先拿到令牌, 需要等待的时间超过max_wait时快速失败
+    """
+
+    def __init__(self, rate: float, *, burst: int = 1, max_wait: float = None):
+        """
+        令牌桶限流
+        Args:
+            rate: 每秒产生的令牌数
+            burst: 令牌桶的容量, 即允许的突发请求数
+            max_wait: 最长的等待时间, 单位秒, 默认None一直等待
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        # 统计
+        self.requests = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_time = 0.0
+        self.rejected = 0
+
+    async def acquire(self, url: str = None) -> float:
+        """
+        获取一个令牌, 令牌不足时等待
+        Args:
+            url: 请求的url, 用于异常信息
+        Returns:
+            等待的秒数
+        """
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # 令牌可以为负数, 表示已经被前面等待的请求预约
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if self.max_wait is not None and wait > self.max_wait:
+            self.rejected += 1
+            raise RateLimitError(url=url, message="rate limit exceeded, need wait {:.3f}s".format(wait))
+        self.tokens -= 1
+        self.requests += 1
+        if wait <= 0:
+            return wait
+
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self.tokens += 1  # 取消等待时归还预约的令牌
+            raise
+        finally:
+            self.waiting -= 1
+        self.wait_time += wait
+        return wait
+
+    def snapshot(self, ) -> Dict:
+        """
+        限流的统计
+        Args:
+
+        Returns:
+
+        """
+        return {"requests": self.requests, "waiting": self.waiting, "max_waiting": self.max_waiting,
+                "wait_time": self.wait_time, "rejected": self.rejected}
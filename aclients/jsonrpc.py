@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午9:10
+
+基于AIOHttpClient的JSON-RPC 2.0客户端以及基于sanic的JSON-RPC 2.0服务端
+"""
+import asyncio
+import inspect
+import itertools
+import time
+from json import loads as json_loads
+from typing import Any, Callable, Dict, List, MutableMapping, Optional, Tuple, Union
+
+import aelog
+from sanic import response
+
+from .aio_http_client import AIOHttpClient, TimeoutType
+from .exceptions import FuncArgsError, JsonRPCError
+
+__all__ = ("AIOJRPCClient", "SanicJsonRPC")
+
+# JSON-RPC 2.0规定的错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class _JRPCBatcher(object):
+    """
+    合并同一个服务端点的调用, 同一轮事件循环中或者batch_window时间内的调用作为一个批量请求发送
+    """
+
+    def __init__(self, aio_http: AIOHttpClient, url: str, *, batch_window: float = 0, max_batch_size: int = 100,
+                 timeout: TimeoutType = None):
+        """
+        合并同一个服务端点的调用
+        Args:
+            aio_http: AIOHttpClient实例
+            url: 服务端点的url
+            batch_window: 等待合并的时间, 单位秒, 0为只合并同一轮事件循环中的调用
+            max_batch_size: 每个批量请求最多的调用数, 达到后立即发送
+            timeout: 请求的超时
+        """
+        self.aio_http = aio_http
+        self.url = url
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+        # 统计
+        self.calls = 0
+        self.batches = 0
+
+    def submit(self, request: Dict) -> asyncio.Future:
+        """
+        提交一个调用, 返回等待结果的future
+        Args:
+            request: JSON-RPC的请求对象
+        Returns:
+
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        self.calls += 1
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = (loop.call_later(self.batch_window, self.flush) if self.batch_window else
+                                  loop.call_soon(self.flush))
+        return future
+
+    def flush(self, ):
+        """
+        发送所有等待中的调用
+        Args:
+
+        Returns:
+
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            self.batches += 1
+            asyncio.ensure_future(self._send(pending))
+
+    async def _send(self, pending: List[Tuple[Dict, asyncio.Future]]):
+        """
+        发送批量请求, 按照id把响应分发给每个调用
+        Args:
+            pending: [(请求对象, future)]
+        Returns:
+
+        """
+        # 只有一个调用时不使用批量格式, 兼容不支持批量请求的服务端
+        payload = [request for request, _ in pending] if len(pending) > 1 else pending[0][0]
+        try:
+            resp = await self.aio_http.async_post(self.url, json=payload, timeout=self.timeout)
+            replies = resp.json()
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        replies = replies if isinstance(replies, list) else [replies]
+        by_id = {reply.get("id"): reply for reply in replies if isinstance(reply, MutableMapping)}
+        # 整个请求无效时服务端返回一个id为null的错误
+        batch_error = by_id.get(None)
+        for request, future in pending:
+            if future.done():  # 调用方已经取消
+                continue
+            reply = by_id.get(request["id"], batch_error)
+            if reply is None:
+                future.set_exception(JsonRPCError(self.url, code=INTERNAL_ERROR, message="missing response of {}, "
+                                                  "id={}".format(request["method"], request["id"])))
+            elif reply.get("error") is not None:
+                error = reply["error"] if isinstance(reply["error"], MutableMapping) else {"message": reply["error"]}
+                future.set_exception(JsonRPCError(self.url, code=error.get("code"), message=error.get("message"),
+                                                  data=error.get("data")))
+            else:
+                future.set_result(reply.get("result"))
+
+
+class _JRPCCall(object):
+    """
+    链式调用, client["name"].sub(5, 2).test(3).done()
+    """
+
+    def __init__(self, client: "AIOJRPCClient", name: str):
+        """
+        链式调用
+        Args:
+            client: AIOJRPCClient实例
+            name: 注册的服务名称
+        """
+        self._client = client
+        self._name = name
+        self._calls: List[Dict] = []
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def _call(*args, **kwargs) -> "_JRPCCall":
+            if args and kwargs:
+                raise FuncArgsError("JSON-RPC params must be positional or keyword, not both")
+            request = {"jsonrpc": "2.0", "method": method, "id": next(self._client._ids)}
+            if args or kwargs:
+                request["params"] = list(args) if args else kwargs
+            self._calls.append(request)
+            return self
+
+        return _call
+
+    async def done(self, *, return_exceptions: bool = False) -> Union[Any, List[Any]]:
+        """
+        发送所有的调用并等待结果, 同一个服务的调用会和其他协程中的调用合并为一个批量请求
+        Args:
+            return_exceptions: 为True时失败的调用在结果中返回异常, 否则抛出第一个异常
+        Returns:
+            只有一个调用时返回它的结果, 否则按照调用的顺序返回结果列表
+        """
+        batcher = self._client._get_batcher(self._name)
+        calls, self._calls = self._calls, []
+        results = await asyncio.gather(*(batcher.submit(request) for request in calls),
+                                       return_exceptions=return_exceptions)
+        return results[0] if len(results) == 1 else results
+
+
+class AIOJRPCClient(object):
+    """
+    基于AIOHttpClient的JSON-RPC 2.0客户端
+
+    aio_jrpc = AIOJRPCClient(aio_http)
+    aio_jrpc.register("local", ("127.0.0.1", 8000))
+    result = await aio_jrpc["local"].sub(5, 2).done()
+
+    同一个服务在同一轮事件循环中发出的调用, 包括不同协程中的调用, 合并为一个批量请求, 响应按照id分发
+    """
+
+    def __init__(self, aio_http: AIOHttpClient, *, path: str = "/api/jrpc", batch_window: float = 0,
+                 max_batch_size: int = 100, timeout: TimeoutType = None):
+        """
+        JSON-RPC 2.0客户端
+        Args:
+            aio_http: AIOHttpClient实例
+            path: 服务端的url路径
+            batch_window: 等待合并调用的时间, 单位秒, 默认0只合并同一轮事件循环中的调用
+            max_batch_size: 每个批量请求最多的调用数
+            timeout: 请求的超时, 默认使用aio_http的超时
+        """
+        self.aio_http = aio_http
+        self.path = path
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._urls: Dict[str, str] = {}
+        self._batchers: Dict[str, _JRPCBatcher] = {}
+        self._ids = itertools.count(1)
+
+    def register(self, name: str, address: Union[Tuple[str, int], str], *, path: str = None):
+        """
+        注册服务
+        Args:
+            name: 服务名称
+            address: (host, port)或者完整的url
+            path: 服务端的url路径, 默认为初始化时的path
+        Returns:
+
+        """
+        if isinstance(address, str):
+            url = address
+        else:
+            host, port = address
+            url = "http://{}:{}{}".format(host, port, path or self.path)
+        self._urls[name] = url
+        self._batchers.pop(name, None)
+
+    def __getitem__(self, name: str) -> _JRPCCall:
+        if name not in self._urls:
+            raise FuncArgsError("JSON-RPC service {} is not registered".format(name))
+        return _JRPCCall(self, name)
+
+    def _get_batcher(self, name: str) -> _JRPCBatcher:
+        """
+        获取服务对应的合并器
+        Args:
+            name: 服务名称
+        Returns:
+
+        """
+        if name not in self._batchers:
+            self._batchers[name] = _JRPCBatcher(self.aio_http, self._urls[name], batch_window=self.batch_window,
+                                                max_batch_size=self.max_batch_size, timeout=self.timeout)
+        return self._batchers[name]
+
+    def batch_stats(self, ) -> Dict[str, Dict[str, int]]:
+        """
+        每个服务的调用数和实际发送的请求数
+        Args:
+
+        Returns:
+
+        """
+        return {name: {"calls": batcher.calls, "batches": batcher.batches}
+                for name, batcher in self._batchers.items()}
+
+
+class _JRPCMethod(object):
+    """
+    注册的方法, 注册时预先计算好参数校验需要的签名信息
+    """
+    # 只校验这些简单类型的注解, int可以作为float
+    _CHECK_TYPES = (int, float, str, bool, list, dict)
+
+    def __init__(self, func: Callable):
+        """
+        注册的方法
+        Args:
+            func: 处理函数, 可以是同步或者异步函数
+        """
+        self.func = func
+        self.signature = inspect.signature(func)
+        self.annotations = {name: param.annotation for name, param in self.signature.parameters.items()
+                            if param.annotation in self._CHECK_TYPES}
+        # 统计
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def validate(self, params: Union[List, Dict, None]) -> Optional[str]:
+        """
+        按照函数签名校验参数
+        Args:
+            params: JSON-RPC请求的params
+        Returns:
+            错误信息, 参数正确时返回None
+        """
+        try:
+            bound = (self.signature.bind(**params) if isinstance(params, MutableMapping) else
+                     self.signature.bind(*(params or ())))
+        except TypeError as e:
+            return str(e)
+        for name, value in bound.arguments.items():
+            annotation = self.annotations.get(name)
+            if annotation is None or isinstance(value, annotation):
+                continue
+            if annotation is float and isinstance(value, int):
+                continue
+            return "param {} must be {}, got {}".format(name, annotation.__name__, type(value).__name__)
+        return None
+
+    def record(self, elapsed: float, failed: bool):
+        """
+        记录一次调用的耗时
+        Args:
+            elapsed: 耗时, 单位秒
+            failed: 是否失败
+        Returns:
+
+        """
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def stats(self, ) -> Dict[str, Union[int, float]]:
+        """
+        调用的统计
+        Args:
+
+        Returns:
+
+        """
+        return {"calls": self.calls, "errors": self.errors, "total_time": self.total_time, "max_time": self.max_time,
+                "avg_time": self.total_time / self.calls if self.calls else 0.0}
+
+
+class SanicJsonRPC(object):
+    """
+    基于sanic的JSON-RPC 2.0服务端
+
+    jsonrpc = SanicJsonRPC()
+    jsonrpc.init_app(app)
+
+    @jsonrpc.jrpc
+    async def sub(a: int, b: int) -> int:
+        return a - b
+
+    批量请求中的调用并发执行, 并发数由concurrency限制
+    """
+
+    def __init__(self, app=None, *, path: str = "/api/jrpc", concurrency: int = 10):
+        """
+        JSON-RPC 2.0服务端
+        Args:
+            app: app应用
+            path: 服务的url路径
+            concurrency: 每个批量请求中同时执行的调用数
+        """
+        self.app = app
+        self.path = path
+        self.concurrency = concurrency
+        self._methods: Dict[str, _JRPCMethod] = {}
+
+        if app is not None:
+            self.init_app(app, path=self.path, concurrency=self.concurrency)
+
+    def init_app(self, app, *, path: str = None, concurrency: int = None):
+        """
+        JSON-RPC 2.0服务端
+        Args:
+            app: app应用
+            path: 服务的url路径
+            concurrency: 每个批量请求中同时执行的调用数
+        Returns:
+
+        """
+        self.app = app
+        self.path = path or app.config.get("ACLIENTS_JRPC_PATH", None) or self.path
+        self.concurrency = concurrency or app.config.get("ACLIENTS_JRPC_CONCURRENCY", None) or self.concurrency
+        app.add_route(self._handle_request, self.path, methods=["POST"], name="aclients_jsonrpc")
+
+    def jrpc(self, func: Callable) -> Callable:
+        """
+        注册JSON-RPC方法的装饰器, 方法名为函数名
+        Args:
+            func: 处理函数
+        Returns:
+
+        """
+        self._methods[func.__name__] = _JRPCMethod(func)
+        return func
+
+    def method_stats(self, ) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        每个方法的调用次数、失败次数和耗时
+        Args:
+
+        Returns:
+
+        """
+        return {name: method.stats() for name, method in self._methods.items()}
+
+    @staticmethod
+    def _error(request_id: Any, code: int, message: str, data: Any = None) -> Dict:
+        """
+        错误响应
+        Args:
+
+        Returns:
+
+        """
+        error = {"code": code, "message": message}
+        if data is not None:
+            error["data"] = data
+        return {"jsonrpc": "2.0", "error": error, "id": request_id}
+
+    async def _handle_request(self, request):
+        """
+        处理单个或者批量的JSON-RPC请求
+        Args:
+            request: sanic的请求
+        Returns:
+
+        """
+        try:
+            payload = json_loads(request.body)
+        except ValueError:
+            return response.json(self._error(None, PARSE_ERROR, "Parse error"))
+
+        if isinstance(payload, list):
+            if not payload:
+                return response.json(self._error(None, INVALID_REQUEST, "Invalid Request"))
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def _call_limited(call: Any):
+                async with semaphore:
+                    return await self._call(call)
+
+            replies = [reply for reply in await asyncio.gather(*(_call_limited(call) for call in payload))
+                       if reply is not None]
+        else:
+            replies = await self._call(payload)
+        # 只有通知时不返回响应体
+        if not replies:
+            return response.raw(b"", status=204)
+        return response.json(replies, ensure_ascii=False)
+
+    async def _call(self, call: Any) -> Optional[Dict]:
+        """
+        执行单个调用
+        Args:
+            call: JSON-RPC的请求对象
+        Returns:
+            响应对象, 通知没有响应时返回None
+        """
+        if not isinstance(call, MutableMapping) or call.get("jsonrpc") != "2.0" or not isinstance(
+                call.get("method"), str) or not isinstance(call.get("params", []), (list, MutableMapping)):
+            return self._error(call.get("id") if isinstance(call, MutableMapping) else None,
+                               INVALID_REQUEST, "Invalid Request")
+        request_id, is_notification = call.get("id"), "id" not in call
+        method = self._methods.get(call["method"])
+        if method is None:
+            return None if is_notification else self._error(request_id, METHOD_NOT_FOUND, "Method not found")
+        error = method.validate(call.get("params"))
+        if error is not None:
+            return None if is_notification else self._error(request_id, INVALID_PARAMS, "Invalid params", error)
+
+        params = call.get("params") or []
+        start_time = time.monotonic()
+        try:
+            result = method.func(**params) if isinstance(params, MutableMapping) else method.func(*params)
+            if inspect.isawaitable(result):
+                result = await result
+        except JsonRPCError as e:
+            method.record(time.monotonic() - start_time, True)
+            reply = self._error(request_id, e.code or INTERNAL_ERROR, e.message, e.data)
+        except Exception as e:
+            method.record(time.monotonic() - start_time, True)
+            aelog.exception(e)
+            reply = self._error(request_id, INTERNAL_ERROR, "Internal error", str(e))
+        else:
+            method.record(time.monotonic() - start_time, False)
+            reply = {"jsonrpc": "2.0", "result": result, "id": request_id}
+        return None if is_notification else reply
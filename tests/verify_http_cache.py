@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午11:20
+
+验证响应缓存和single_flight, 包括键值对列表、查询字符串以及重复的查询参数
+"""
+
+import asyncio
+import atexit
+
+from aiohttp import web
+
+from aclients import AIOHttpClient
+from aclients.http_cache import HttpCache
+
+requests = AIOHttpClient()
+URL = "http://127.0.0.1:8801/cache"
+counter = {"requests": 0}
+
+
+async def cache_handler(request):
+    """
+    返回查询参数和服务端收到的请求数, 响应可以缓存60秒
+    Args:
+
+    Returns:
+
+    """
+    counter["requests"] += 1
+    await asyncio.sleep(0.05)
+    return web.json_response({"query": list(request.query.items()), "requests": counter["requests"]},
+                             headers={"Cache-Control": "max-age=60"})
+
+
+async def start_server():
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    app = web.Application()
+    app.router.add_get("/cache", cache_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8801).start()
+    return runner
+
+
+def make_key_verify():
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    # 同名参数保持顺序, 不同名的参数和请求头与顺序无关
+    key = HttpCache.make_key(URL + "?z=1", [("a", "1"), ("a", "2")], {"X-Test": 1})
+    assert key == (URL, (("a", "1"), ("a", "2"), ("z", "1")), (("x-test", "1"),))
+    assert HttpCache.make_key(URL, "a=1&b=2") == HttpCache.make_key(URL, {"b": "2", "a": "1"})
+    assert HttpCache.make_key(URL, [("a", "1"), ("a", "2")]) != HttpCache.make_key(URL, [("a", "2"), ("a", "1")])
+    assert HttpCache.make_key(URL, headers={"X-Test": "1"}) == HttpCache.make_key(URL, headers=[("x-test", "1")])
+    # 无法构造键时不缓存
+    assert HttpCache.make_key(URL, {"a": object()}) is None
+    print("make_key ok")
+
+
+async def cache_verify(params):
+    """
+    相同的请求第二次命中缓存
+    Args:
+
+    Returns:
+
+    """
+    first = await requests.async_get(URL, params=params, headers=[("X-Test", "cache")])
+    second = await requests.async_get(URL, params=params, headers=[("X-Test", "cache")])
+    print("cache", params, first.json())
+    assert first.json()["requests"] == second.json()["requests"]
+
+
+async def single_flight_verify(params):
+    """
+    同时发出的相同请求只发送一次
+    Args:
+
+    Returns:
+
+    """
+    responses = await asyncio.gather(*(requests.async_get(URL, params=params, use_cache=False) for _ in range(5)))
+    print("single_flight", params, [resp.json()["requests"] for resp in responses])
+    assert len({resp.json()["requests"] for resp in responses}) == 1
+    assert responses[0].json()["query"] == [list(item) for item in params]
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    requests.init_session(response_cache=True, single_flight=True)
+    server = loop.run_until_complete(start_server())
+    make_key_verify()
+    for query in ([("a", "1"), ("a", "2")], "a=1&b=2", {"a": "1"}):
+        loop.run_until_complete(cache_verify(query))
+    loop.run_until_complete(single_flight_verify([("repeat", "1"), ("repeat", "2")]))
+    loop.run_until_complete(server.cleanup())
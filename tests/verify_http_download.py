@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午12:10
+
+验证分段下载、中断后续传以及服务端忽略Range时退回单个连接下载
+"""
+
+import asyncio
+import atexit
+import hashlib
+import os
+import re
+import tempfile
+
+from aiohttp import web
+
+from aclients import AIOHttpClient
+from aclients.exceptions import ClientConnectionError
+
+requests = AIOHttpClient()
+URL = "http://127.0.0.1:8802/file"
+DATA = os.urandom(4 * 1024 * 1024 + 7)
+# fail_from: 从这个位置开始的分段只发送一半后断开连接, ignore_range: 忽略Range返回完整的响应
+server_state = {"etag": '"v1"', "fail_from": None, "ignore_range": False, "ranges": []}
+part_starts = set()
+
+
+async def file_handler(request):
+    """
+    支持Range的文件下载
+    Args:
+
+    Returns:
+
+    """
+    headers = {"Accept-Ranges": "bytes", "ETag": server_state["etag"]}
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(DATA))
+        return web.Response(headers=headers)
+    range_header = request.headers.get("Range")
+    server_state["ranges"].append((range_header, request.headers.get("If-Range")))
+    # 弱ETag不能用于If-Range, 收到时按照RFC忽略Range
+    if (not range_header or server_state["ignore_range"] or
+            request.headers.get("If-Range", "").startswith("W/")):
+        return web.Response(body=DATA, headers=headers)
+
+    match = re.match(r"bytes=(\d+)-(\d*)", range_header)
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else len(DATA) - 1
+    body = DATA[start:end + 1]
+    headers.update({"Content-Range": "bytes {}-{}/{}".format(start, end, len(DATA)),
+                    "Content-Length": str(len(body))})
+    response = web.StreamResponse(status=206, headers=headers)
+    await response.prepare(request)
+    if server_state["fail_from"] is not None and start >= server_state["fail_from"]:
+        await response.write(body[:len(body) // 2])
+        request.transport.close()
+        return response
+    await response.write(body)
+    await response.write_eof()
+    return response
+
+
+async def start_server():
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    app = web.Application()
+    app.router.add_route("*", "/file", file_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8802).start()
+    return runner
+
+
+def verify_file(path):
+    """
+    下载的文件和源文件一致并且删除了进度文件
+    Args:
+
+    Returns:
+
+    """
+    with open(path, "rb") as f:
+        assert hashlib.md5(f.read()).digest() == hashlib.md5(DATA).digest()
+    assert not os.path.exists("{}.download".format(path))
+
+
+async def download_verify(path):
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    server_state["ranges"].clear()
+    await requests.async_download(URL, path, parts=4)
+    assert len(server_state["ranges"]) == 4
+    part_starts.update(int(re.match(r"bytes=(\d+)-", item[0]).group(1)) for item in server_state["ranges"])
+    verify_file(path)
+    print("download ok")
+
+
+async def resume_verify(path):
+    """
+    后半部分的分段中断后保存进度, 再次下载时只请求缺少的部分
+    Args:
+
+    Returns:
+
+    """
+    os.remove(path)
+    server_state["fail_from"] = len(DATA) // 2
+    try:
+        await requests.async_download(URL, path, parts=4)
+    except ClientConnectionError as e:
+        print("interrupted", e)
+    else:
+        raise AssertionError("download should be interrupted")
+    assert os.path.exists("{}.download".format(path))
+
+    server_state["fail_from"] = None
+    server_state["ranges"].clear()
+    await requests.async_download(URL, path, parts=4)
+    # 每个分段都从进度文件记录的位置续传, 已经下载的部分不再请求
+    resumed = [tuple(int(value) for value in re.match(r"bytes=(\d+)-(\d+)", item[0]).groups())
+               for item in server_state["ranges"]]
+    assert len(resumed) == 4
+    assert not part_starts & {start for start, _ in resumed}
+    assert sum(end - start + 1 for start, end in resumed) < len(DATA)
+    assert all(if_range == server_state["etag"] for _, if_range in server_state["ranges"])
+    verify_file(path)
+    print("resume ok")
+
+
+async def fallback_verify(path):
+    """
+    服务端忽略Range或者只有弱ETag时退回单个连接下载
+    Args:
+
+    Returns:
+
+    """
+    server_state["ignore_range"] = True
+    server_state["ranges"].clear()
+    await requests.async_download(URL, path, parts=4)
+    assert server_state["ranges"][-1] == (None, None)
+    verify_file(path)
+    server_state["ignore_range"] = False
+
+    server_state["etag"] = 'W/"v2"'
+    server_state["ranges"].clear()
+    await requests.async_download(URL, path, parts=4)
+    assert all(if_range is None for _, if_range in server_state["ranges"])
+    verify_file(path)
+    print("fallback ok")
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    requests.init_session()
+    server = loop.run_until_complete(start_server())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "file.bin")
+        loop.run_until_complete(download_verify(file_path))
+        loop.run_until_complete(resume_verify(file_path))
+        loop.run_until_complete(fallback_verify(file_path))
+    loop.run_until_complete(server.cleanup())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午11:40
+
+验证进程内缓存的失效通知, 两个客户端模拟两个进程, 需要本地的redis服务
+"""
+
+import asyncio
+
+from aclients.aio_redis_client import AIORedisClient, Session
+
+# 每个客户端有自己的进程内缓存和订阅, 一个写入后另一个不能再读到老的值
+writer = AIORedisClient(near_cache={"ttl": 60})
+reader = AIORedisClient(near_cache={"ttl": 60})
+
+
+async def wait_invalidation():
+    """
+    等待失效通知送达
+    Args:
+
+    Returns:
+
+    """
+    await asyncio.sleep(0.2)
+
+
+async def usual_data_verify():
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    await writer.save_update_usual_data("verify:usual", {"v": 1})
+    # 读取期间收到失效通知时不会缓存读取的结果
+    await wait_invalidation()
+    assert (await reader.get_usual_data("verify:usual"))["v"] == 1
+    # 第二次读取命中进程内缓存
+    hits = reader.near_cache.hits
+    assert (await reader.get_usual_data("verify:usual"))["v"] == 1
+    assert reader.near_cache.hits == hits + 1
+    await writer.save_update_usual_data("verify:usual", {"v": 2})
+    await wait_invalidation()
+    assert (await reader.get_usual_data("verify:usual"))["v"] == 2
+
+    await writer.incrbynumber("verify:counter", 1)
+    assert await reader.get_usual_data("verify:counter") == 1
+    await writer.incrbynumber("verify:counter", 5)
+    await wait_invalidation()
+    assert await reader.get_usual_data("verify:counter") == 6
+
+    await writer.delete_keys(["verify:counter"])
+    await wait_invalidation()
+    assert await reader.get_usual_data("verify:counter") is None
+
+    for index in range(3):
+        await writer.save_update_usual_data("verify:pattern:{}".format(index), index)
+        await reader.get_usual_data("verify:pattern:{}".format(index))
+    assert await writer.delete_by_pattern("verify:pattern:*", chunk_size=2) == 3
+    await wait_invalidation()
+    for index in range(3):
+        assert await reader.get_usual_data("verify:pattern:{}".format(index)) is None
+    print("usual data ok", reader.near_cache.stats())
+
+
+async def session_verify():
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    session = Session("verify_account", x="1")
+    session_id = await writer.save_session(session)
+    assert (await reader.get_session(session_id)).x == "1"
+
+    # 使用已有的session_id重新保存
+    session.x = "2"
+    await writer.save_session(session)
+    await wait_invalidation()
+    assert (await reader.get_session(session_id)).x == "2"
+
+    session.x = "3"
+    await writer.update_session(session)
+    await wait_invalidation()
+    assert (await reader.get_session(session_id)).x == "3"
+
+    await writer.save_update_hash_data(session_id, "E", field_name="extra")
+    await wait_invalidation()
+    assert (await reader.get_session(session_id, cls_flag=False))["extra"] == "E"
+    print("session ok")
+
+
+async def delete_session_verify():
+    """
+    删除session时和账户相关的key也要失效
+    Args:
+
+    Returns:
+
+    """
+    session = Session("verify_account")
+    session_id = await writer.save_session(session)
+    await writer.save_update_usual_data(session.org_id, {"org": 1})
+    await writer.save_update_usual_data(session.role_id, {"role": 1})
+    for client in (writer, reader):
+        await client.get_session(session_id)
+        assert await client.get_usual_data(session.org_id) == {"org": 1}
+        assert await client.get_usual_data(session.role_id) == {"role": 1}
+
+    await writer.delete_session(session_id)
+    await wait_invalidation()
+    for client in (writer, reader):
+        assert await client.get_usual_data(session.org_id) is None
+        assert await client.get_usual_data(session.role_id) is None
+    print("delete session ok")
+
+
+async def reconnect_verify():
+    """
+    订阅的连接断开重连后清空缓存
+    Args:
+
+    Returns:
+
+    """
+    await writer.save_update_usual_data("verify:reconnect", 1)
+    await reader.get_usual_data("verify:reconnect")
+    generation = reader.near_cache.generation
+    await writer.redis_db.execute_command("CLIENT", "KILL", "TYPE", "pubsub")
+    await asyncio.sleep(0.5)
+    assert reader.near_cache.generation != generation
+    assert reader.near_cache.stats()["entries"] == 0
+    print("reconnect ok")
+
+
+async def stop_verify():
+    """
+    停止订阅后任务是正常结束的
+    Args:
+
+    Returns:
+
+    """
+    for client in (writer, reader):
+        task = client._invalidation_task
+        await client._stop_invalidation()
+        assert task.done() and (task.cancelled() or task.exception() is None)
+    print("stop ok")
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    writer.init_engine()
+    reader.init_engine()
+    loop.run_until_complete(asyncio.sleep(0.3))
+    loop.run_until_complete(usual_data_verify())
+    loop.run_until_complete(session_verify())
+    loop.run_until_complete(delete_session_verify())
+    loop.run_until_complete(reconnect_verify())
+    loop.run_until_complete(stop_verify())